@@ -1,57 +1,233 @@
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
 import os
 import json
+import threading
+from contextlib import contextmanager
+import numpy as np
 from PIL import Image
+from detection_cache import DetectionCache
+from preprocess import PreparedImage, prepare_image
+import metrics
 
-def food_detect(input_image_path):
-    # Load the model
-    model = YOLO('last.pt')  # Ensure the path to your best.pt is correct
+# Detector backend: "torch" runs the .pt weights, "onnx"/"onnx-int8" the exported ONNX Runtime models
+BACKEND_SUFFIXES = {"torch": None, "onnx": ".onnx", "onnx-int8": ".int8.onnx"}
 
-    # Run inference on the image
-    results = model(input_image_path,conf=0.5)
 
-    # Extract the base name of the input image
-    input_filename = os.path.basename(input_image_path)
-    filename_without_ext, ext = os.path.splitext(input_filename)
+def backend_weights(weights_path, backend="torch"):
+    if backend not in BACKEND_SUFFIXES:
+        raise ValueError(f"Unknown detector backend: {backend}")
+    suffix = BACKEND_SUFFIXES[backend]
+    if suffix is None:
+        return weights_path
+    return os.path.splitext(weights_path)[0] + suffix
 
-    # Ensure the output directory exists
-    output_dir = 'test_images/output/'
-    os.makedirs(output_dir, exist_ok=True)
 
-    # Save the annotated image
-    output_image_path = os.path.join(output_dir, f'{filename_without_ext}_output{ext}')
-    results[0].save(filename=output_image_path)
+DETECTOR_BACKEND = os.getenv("SMARTBITE_BACKEND", "torch")
+DEFAULT_WEIGHTS = backend_weights(os.getenv("SMARTBITE_WEIGHTS", "last.pt"), DETECTOR_BACKEND)
+WARMUP_SIZE = 640
+# Every box the model returns above DETECT_CONFIDENCE is counted, but only for foods whose
+# best box reaches MIN_CONFIDENCE; other foods never reach the meal, the image or the lookup
+DETECT_CONFIDENCE = 0.5
+MIN_CONFIDENCE = float(os.getenv("MIN_CONFIDENCE", "0.8"))
 
-    # Load the saved image for display
-    output_image = Image.open(output_image_path)
+# Shared cache of detection results for repeated and near-identical uploads
+detection_cache = DetectionCache(
+    max_entries=int(os.getenv("DETECTION_CACHE_SIZE", "128")),
+    spill_dir=os.getenv("DETECTION_CACHE_DIR") or None,
+    max_spilled=int(os.getenv("DETECTION_CACHE_SPILL_SIZE", "1024"))
+)
 
-    # Extract food names, confidence scores, and count occurrences
-    food_counts = {}
+# Process-wide model registry, one loaded model per weights file
+_models = {}
+_ready = set()
+_registry_lock = threading.Lock()
+# Idle models for video tracking, kept per weights file and reused by later streams
+_tracking_models = {}
+
+
+def get_model(weights_path=DEFAULT_WEIGHTS):
+    model = _models.get(weights_path)
+    if model is not None:
+        return model
+    with _registry_lock:
+        # Another thread may have loaded it while we waited for the lock
+        if weights_path not in _models:
+            with metrics.span("model_load"):
+                _models[weights_path] = YOLO(weights_path, task="detect")
+        return _models[weights_path]
+
+
+def register_model(weights_path, model):
+    # Install an already-built model (e.g. a stand-in for benchmarks) under a weights key
+    with _registry_lock:
+        _models[weights_path] = model
+        _ready.discard(weights_path)
+
+
+def warmup(weights_path=DEFAULT_WEIGHTS):
+    model = get_model(weights_path)
+    if weights_path not in _ready:
+        # First inference pays for lazy initialisation (fusing, allocator, kernels)
+        blank = np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)
+        model(blank, verbose=False)
+        _ready.add(weights_path)
+    return model
+
+
+def model_ready(weights_path=DEFAULT_WEIGHTS):
+    return weights_path in _ready
+
+
+@contextmanager
+def tracking_model(weights_path=DEFAULT_WEIGHTS):
+    # model.track leaves tracker callbacks on the model, which would then run on every
+    # food_detect call, so tracking never touches the shared model from get_model. Each
+    # stream checks out its own instance, loaded once and kept for the next stream.
+    with _registry_lock:
+        idle = _tracking_models.setdefault(weights_path, [])
+        model = idle.pop() if idle else None
+    if model is None:
+        with metrics.span("model_load"):
+            model = YOLO(weights_path, task="detect")
+    elif hasattr(getattr(model, "predictor", None), "trackers"):
+        # Start the next stream from empty tracks. The trackers themselves stay: without them
+        # track() registers its callbacks again and every frame would be tracked twice
+        for tracker in model.predictor.trackers:
+            tracker.reset()
+    try:
+        yield model
+    finally:
+        with _registry_lock:
+            _tracking_models[weights_path].append(model)
+
+
+def record_speed(results):
+    # Ultralytics reports per-image preprocess/inference/postprocess times in ms
     for result in results:
-        for box in result.boxes:
-            food_name = model.names[int(box.cls)]  # Class name
-            confidence = float(box.conf)           # Confidence score
-
-            if food_name in food_counts:
-                food_counts[food_name]['count'] += 1
-                #if confidence<0.8:
-                    #continue
-                food_counts[food_name]['confidences'].append(confidence)
-            else:
-                food_counts[food_name] = {
-                    'count': 1,
-                    'confidences': [confidence]
-                }
-
-    # Prepare the final JSON structure
-    detected_foods = [
+        speed = getattr(result, "speed", None) or {}
+        for stage in ("preprocess", "inference", "postprocess"):
+            if speed.get(stage) is not None:
+                metrics.observe(f"detect_{stage}", speed[stage] / 1000)
+
+
+def kept_boxes(result, min_confidence=MIN_CONFIDENCE):
+    # Rows of x1, y1, x2, y2, [track id], conf, cls on the host, keeping all boxes of the
+    # foods whose highest confidence makes the cut
+    data = result.boxes.cpu().numpy().data
+    if not len(data):
+        return data
+    classes = data[:, -1].astype(np.intp)
+    best = np.zeros(classes.max() + 1, dtype=data.dtype)
+    np.maximum.at(best, classes, data[:, -2])
+    return data[best[classes] >= min_confidence]
+
+
+def detected_foods(result, names, boxes=None):
+    # Per-class count and highest confidence straight from the box array
+    if boxes is None:
+        boxes = kept_boxes(result)
+    if not len(boxes):
+        return []
+    classes = boxes[:, -1].astype(np.intp)
+    confidences = boxes[:, -2]
+    counts = np.bincount(classes)
+    best = np.zeros(counts.size, dtype=confidences.dtype)
+    np.maximum.at(best, classes, confidences)
+
+    # Foods in order of first appearance, as the per-box loop produced them
+    _, first = np.unique(classes, return_index=True)
+    return [
         {
-            "food_name": food_name,
-            "food_count": info["count"],
-            "confidence": max(info["confidences"])  # Return the highest confidence
+            "food_name": names[class_id],
+            "food_count": int(counts[class_id]),
+            "confidence": float(best[class_id])
         }
-        for food_name, info in food_counts.items()
+        for class_id in classes[np.sort(first)]
     ]
 
-    json_output = json.dumps(detected_foods, indent=4)
-    return json_output, output_image
+
+def annotated_image(result, prepared=None, boxes=None):
+    # Only the boxes that made the cut are drawn
+    if boxes is None:
+        boxes = kept_boxes(result)
+    display = result.orig_img
+    if prepared is not None and prepared.scale != 1:
+        # Boxes are in model_input coordinates, map them onto the display-sized image
+        boxes = boxes.copy()
+        boxes[:, :4] *= prepared.scale
+        display = np.ascontiguousarray(np.asarray(prepared.display)[..., ::-1])
+    result = Results(display, path=result.path, names=result.names, boxes=boxes)
+    # Render the annotated image straight from the result (plot() returns BGR)
+    return Image.fromarray(np.ascontiguousarray(result.plot()[..., ::-1]))
+
+
+def food_detect(image, weights_path=DEFAULT_WEIGHTS, save_dir=None, cache=detection_cache):
+    # Explicit disk output always runs the model so the file actually gets written
+    if cache is None or save_dir is not None:
+        return _food_detect(image, weights_path, save_dir)
+    if isinstance(image, PreparedImage):
+        # Already decoded by the caller: key on the model input, nothing left to decode
+        key_image, decode = image.model_input, lambda _: image
+    else:
+        key_image, decode = image, prepare_image
+    return cache.get_or_compute(
+        key_image,
+        lambda prepared: _food_detect(prepared, weights_path),
+        namespace=f"{weights_path}@{MIN_CONFIDENCE}",
+        decode=decode,
+        hash_image=lambda prepared: prepared.model_input
+    )
+
+
+def _food_detect(image, weights_path=DEFAULT_WEIGHTS, save_dir=None):
+    # Load the model (cached for the lifetime of the process)
+    model = get_model(weights_path)
+
+    # Decode at reduced size, fix orientation and resize once, entirely in memory
+    with metrics.span("detect_decode"):
+        prepared = prepare_image(image)
+    with metrics.span("detect_model_call"):
+        results = model(prepared.model_input, conf=DETECT_CONFIDENCE, verbose=False)
+    record_speed(results)
+
+    with metrics.span("detect_boxes"):
+        boxes = kept_boxes(results[0])
+        foods = detected_foods(results[0], model.names, boxes)
+    with metrics.span("detect_annotate"):
+        output_image = annotated_image(results[0], prepared, boxes)
+
+    # Only touch the filesystem when the caller asks for a copy on disk
+    if save_dir is not None:
+        if isinstance(image, (str, os.PathLike)):
+            filename_without_ext, ext = os.path.splitext(os.path.basename(image))
+        else:
+            filename_without_ext, ext = 'detection', '.jpg'
+        os.makedirs(save_dir, exist_ok=True)
+        with metrics.span("detect_save"):
+            output_image.save(os.path.join(save_dir, f'{filename_without_ext}_output{ext}'))
+
+    return json.dumps(foods, indent=4), output_image
+
+
+def food_detect_batch(images, batch_size=8, weights_path=DEFAULT_WEIGHTS, annotate=True):
+    model = get_model(weights_path)
+    images = list(images)
+
+    batch_results = []
+    for start in range(0, len(images), batch_size):
+        chunk = [prepare_image(image) for image in images[start:start + batch_size]]
+
+        # A list source is stacked into a single forward pass by Ultralytics
+        with metrics.span("detect_batch_model_call"):
+            results = model([prepared.model_input for prepared in chunk], conf=DETECT_CONFIDENCE, verbose=False)
+        record_speed(results)
+        metrics.inc("detect_batch_images", len(chunk))
+
+        for result, prepared in zip(results, chunk):
+            boxes = kept_boxes(result)
+            batch_results.append({
+                "foods": detected_foods(result, model.names, boxes),
+                "image": annotated_image(result, prepared, boxes) if annotate else None
+            })
+    return batch_results
@@ -2,8 +2,11 @@ from supabase import create_client
 from datetime import datetime, timezone
 import pytz
 import os
+import uuid
 from dotenv import load_dotenv
 from supabase import Client
+from storage import as_storage
+import metrics
 
 
 def timestampz():
@@ -14,25 +17,20 @@ def todays_date():
     return datetime.today().strftime("%Y-%m-%d")
 
 
+@metrics.timed("db_get_data")
 def get_data(supabase:Client,table_name: str) -> list:
     try:
-        response = supabase.table(table_name).select("*").execute()
-        return response
+        return as_storage(supabase).get_all(table_name)
     except Exception as e:
         raise ValueError(f"Error fetching data from {table_name}: {str(e)}")
 
+@metrics.timed("db_get_cal_consumed")
 def get_cal_consumed(supabase:Client,user_id: str, today_date: str) -> int:
     try:
-        calories_data = (
-            supabase.table("Daily")
-            .select("cal_consumed")
-            .eq("user_id", user_id)
-            .eq("date", today_date)
-            .execute()
-        )
-        # print(f"Raw response: {calories_data.data}")
-        if calories_data.data and len(calories_data.data) > 0:
-            cal_value = calories_data.data[0]["cal_consumed"]
+        calories_data = as_storage(supabase).get_daily(user_id, today_date)
+        # print(f"Raw response: {calories_data}")
+        if calories_data:
+            cal_value = calories_data["cal_consumed"]
             # print(f"Found calorie value: {cal_value}")
             return cal_value
         return 0
@@ -40,67 +38,72 @@ def get_cal_consumed(supabase:Client,user_id: str, today_date: str) -> int:
         # print(f"Error in get_cal_consumed: {str(e)}")
         raise ValueError(f"Error fetching cal_consumed: {str(e)}")
 
+@metrics.timed("db_ensure_daily_entry")
 def ensure_daily_entry(supabase:Client,user_id: str, today_date: str):
     try:
-        response = supabase.table("Daily").select("*").eq("user_id", user_id).eq("date", today_date).execute()
-        if not response.data:
-            supabase.table("Daily").insert({
+        storage = as_storage(supabase)
+        if not storage.get_daily(user_id, today_date):
+            storage.insert_daily({
                 "user_id": user_id,
                 "date": today_date,
                 "cal_consumed": 0,
                 "cal_burnt": 0,
                 "steps": 0,
                 "distance": 0.0
-            }).execute()
+            })
             # print(f"Inserted new row in Daily for user_id={user_id} and date={today_date}")
     except Exception as e:
         raise ValueError(f"Error ensuring Daily entry: {str(e)}")
 
+@metrics.timed("db_new_meal_insert")
 def new_meal_insert(supabase:Client,user_id, today_date, meal_cal, foods_detected):
     try:
         # Ensure Daily entry exists
         ensure_daily_entry(supabase,user_id, today_date)
 
         # Insert into Meals
-        response = supabase.table("Meals").insert({
+        as_storage(supabase).insert_meal({
             "user_id": user_id,
             "date": today_date,
             "timestamp": timestampz(),
             "meal_cal": meal_cal,
             "foods_detected": foods_detected
-        }).execute()
+        })
+    except Exception as e:
+        raise ValueError(f"Error inserting new meal: {str(e)}")
 
-        # print(f"Response from Meals insert: {response}")
 
+@metrics.timed("db_save_meal")
+def save_meal(supabase:Client,user_id, today_date, meal_cal, foods_detected, request_id=None) -> dict:
+    # Daily row, meal insert and updated totals in one round trip; retrying with the
+    # same request_id never inserts the meal twice
+    try:
+        return as_storage(supabase).save_meal({
+            "user_id": user_id,
+            "date": today_date,
+            "timestamp": timestampz(),
+            "meal_cal": meal_cal,
+            "foods_detected": foods_detected,
+            "request_id": request_id or str(uuid.uuid4())
+        })
     except Exception as e:
-        raise ValueError(f"Error inserting new meal: {str(e)}")
+        raise ValueError(f"Error saving meal: {str(e)}")
 
     
+@metrics.timed("db_get_user_data")
 def get_user_data(supabase:Client,user_id: str) -> dict:
 
     try:
-        response = (
-            supabase.table("Daily")
-            .select("*").eq("user_id", user_id)
-            .execute()
-        )
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return {}
+        return as_storage(supabase).get_user_daily(user_id) or {}
     except Exception as e:
         raise ValueError(f"Error fetching user data: {str(e)}")
 
+@metrics.timed("db_get_latest_daily_data")
 def get_latest_daily_data(supabase:Client,user_id):
     today = todays_date()
-    result = (
-        supabase.table("Daily")
-        .select("*")
-        .eq("user_id", user_id)
-        .eq("date", today)
-        .execute()
-    )
-    if result.data:
-        return result.data[0]  # Return the first record (there should only be one)
+    result = as_storage(supabase).get_daily(user_id, today)
+    if result:
+        return result  # There is at most one record per user and date
     else:
         # If no record for today, return default data
         return {
@@ -108,4 +111,21 @@ def get_latest_daily_data(supabase:Client,user_id):
             "cal_burnt": 0,
             "steps": 0,
             "distance": 0.0,
-        }
\ No newline at end of file
+        }
+
+
+@metrics.timed("db_get_daily_totals")
+def get_daily_totals(supabase:Client,user_id, since_date=None) -> list:
+    # One Daily rollup row per day, oldest first
+    try:
+        return as_storage(supabase).list_daily(user_id, since_date)
+    except Exception as e:
+        raise ValueError(f"Error fetching daily totals: {str(e)}")
+
+@metrics.timed("db_get_food_totals")
+def get_food_totals(supabase:Client,user_id, since_date=None) -> list:
+    # Per-day, per-food rollup rows kept up to date by the Meals insert trigger
+    try:
+        return as_storage(supabase).list_food_totals(user_id, since_date)
+    except Exception as e:
+        raise ValueError(f"Error fetching food totals: {str(e)}")
@@ -0,0 +1,237 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image
+from ultralytics.engine.results import Results
+
+import ai_model
+import fitbit
+import metrics
+from api_info import save_meal, todays_date
+from nutrition import NutritionIndex, meal_nutrition
+from storage import SQLiteStorage
+from preprocess import prepare_image
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, peak memory comes from psutil there
+    resource = None
+
+STUB_WEIGHTS = "stub"
+STUB_NAMES = {0: "rice", 1: "dal", 2: "chapati", 3: "idli", 4: "dosa", 5: "sambar"}
+STAGES = ["decode", "detect", "nutrition", "save", "fitbit"]
+
+
+class StubModel:
+    # Deterministic stand-in for the YOLO model, same call and result shape
+    names = STUB_NAMES
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+
+    def __call__(self, source, conf=0.25, verbose=False):
+        sources = source if isinstance(source, list) else [source]
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        results = []
+        for image in sources:
+            if isinstance(image, Image.Image):
+                image = np.asarray(image.convert("RGB"))[..., ::-1]  # Ultralytics works in BGR
+            height, width = image.shape[:2]
+            seed = int(image[::64, ::64].sum()) % (2 ** 32)
+            rng = np.random.default_rng(seed)
+            count = int(rng.integers(1, 6))
+            # Rows of x1, y1, x2, y2, conf, cls like a real detection head after NMS
+            corners = np.sort(rng.uniform(0, 1, (count, 2, 2)), axis=1).reshape(count, 4)
+            xyxy = corners * [width, height, width, height]
+            scores = rng.uniform(conf, 1.0, (count, 1))
+            cls = rng.integers(0, len(STUB_NAMES), (count, 1))
+            boxes = np.hstack([xyxy, scores, cls]).astype(np.float32)
+            results.append(Results(np.ascontiguousarray(image), path="stub", names=STUB_NAMES, boxes=boxes))
+        return results
+
+
+class StubFitbitClient:
+    def daily_summary(self, access_token, date=None):
+        return {"steps": 4200, "caloriesOut": 1850, "distances": [{"activity": "total", "distance": 3.1}]}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def rank(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples),
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "max_ms": samples[-1],
+    }
+
+
+def peak_rss_mb():
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    # peak_wset is the Windows peak working set; other platforms only report the current RSS
+    return getattr(memory, "peak_wset", memory.rss) / (1024 * 1024)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_corpus(image_dir):
+    paths = sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp")
+        for path in glob.glob(os.path.join(image_dir, pattern))
+    )
+    if not paths:
+        raise SystemExit(f"No images found in {image_dir}")
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+def setup(args):
+    if args.model == "stub":
+        weights = STUB_WEIGHTS
+        ai_model.register_model(weights, StubModel(args.stub_latency_ms))
+    else:
+        weights = args.weights
+    model = ai_model.warmup(weights)
+
+    storage = SQLiteStorage(args.db)
+    # Seed CALORIES for every class the model can emit
+    storage.load_calories([
+        {"food_name": name, "servings": 100 + 10 * i, "grams": 1.0 + i / 10}
+        for i, name in model.names.items()
+    ])
+    storage.save_fitbit_token(args.user_id, "benchmark-token")
+    fitbit._client = StubFitbitClient()
+    return weights, storage
+
+
+def run_once(image_bytes, weights, storage, index, user_id, timings):
+    def timed(stage, fn, *fn_args, **fn_kwargs):
+        start = time.perf_counter()
+        value = fn(*fn_args, **fn_kwargs)
+        timings[stage].append((time.perf_counter() - start) * 1000)
+        return value
+
+    image = timed("decode", prepare_image, image_bytes)
+    json_out, _ = timed("detect", ai_model.food_detect, image, weights_path=weights, cache=None)
+    result = timed("nutrition", meal_nutrition, json.loads(json_out), index)
+    meal_cal = sum(item["calories_servings"] for item in result)
+    foods = [
+        {"food_name": item["food"], "count": item["portion"], "calories": item["calories_servings"],
+         "grams": None, "confidence": item["confidence"]}
+        for item in result
+    ]
+    timed("save", save_meal, storage, user_id, todays_date(), meal_cal, foods)
+    timed("fitbit", fitbit.get_fitbit_summary, storage, user_id)
+
+
+def run(args):
+    corpus = load_corpus(args.images)
+    weights, storage = setup(args)
+    index = NutritionIndex(storage)
+
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(args.warmup):
+        for _, image_bytes in corpus:
+            run_once(image_bytes, weights, storage, index, args.user_id, {stage: [] for stage in STAGES})
+
+    totals = []
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        for _, image_bytes in corpus:
+            run_start = time.perf_counter()
+            run_once(image_bytes, weights, storage, index, args.user_id, timings)
+            totals.append((time.perf_counter() - run_start) * 1000)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "model": args.model,
+            "weights": weights,
+            "images": len(corpus),
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items()},
+        "total": percentiles(totals),
+        "throughput_per_s": len(totals) / elapsed if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "metrics": metrics.snapshot(),
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'stage':<12}{'p50 base':>12}{'p50 now':>12}{'p95 base':>12}{'p95 now':>12}")
+    for stage in STAGES + ["total"]:
+        base = baseline["stages"].get(stage) if stage != "total" else baseline["total"]
+        now = current["stages"].get(stage) if stage != "total" else current["total"]
+        if base and now:
+            print(f"{stage:<12}{base['p50_ms']:>12.2f}{now['p50_ms']:>12.2f}{base['p95_ms']:>12.2f}{now['p95_ms']:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Analyze Food pipeline from upload to saved meal")
+    parser.add_argument("--images", default="public", help="directory of sample images")
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--weights", default=ai_model.DEFAULT_WEIGHTS, help="weights file for --model real")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="simulated forward pass time for the stub")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--db", default=":memory:", help="SQLite database for the stand-in storage")
+    parser.add_argument("--user-id", default="benchmark-user")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to print p50/p95 deltas against")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<12} p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms")
+    total = results["total"]
+    print(f"{'total':<12} p50={total['p50_ms']:.2f}ms p95={total['p95_ms']:.2f}ms p99={total['p99_ms']:.2f}ms")
+    peak_rss = "n/a" if results["peak_rss_mb"] is None else f"{results['peak_rss_mb']:.1f}MB"
+    print(f"throughput={results['throughput_per_s']:.2f}/s peak_rss={peak_rss}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
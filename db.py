@@ -0,0 +1,59 @@
+import os
+import threading
+import httpx
+from dotenv import load_dotenv
+from postgrest.utils import SyncClient
+from supabase import create_client, Client, ClientOptions
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_KEEPALIVE = float(os.getenv("SUPABASE_KEEPALIVE", "60"))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _pooled_session(session):
+    # Same base URL and API key headers as the stock PostgREST session, with a sized keep-alive pool
+    return SyncClient(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=SUPABASE_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_SIZE,
+            keepalive_expiry=SUPABASE_KEEPALIVE
+        ),
+        http2=True,
+        follow_redirects=True
+    )
+
+
+def get_supabase() -> Client:
+    # One client per process for table and RPC calls, shared by every session and helper.
+    # Never sign in on it: auth calls would swap the API key for that user's token.
+    global _client
+    with _client_lock:
+        if _client is None:
+            client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+                postgrest_client_timeout=SUPABASE_TIMEOUT,
+                auto_refresh_token=False,
+                persist_session=False
+            ))
+            stock_session = client.postgrest.session
+            client.postgrest.session = _pooled_session(stock_session)
+            stock_session.close()
+            _client = client
+    return _client
+
+
+def new_auth_client() -> Client:
+    # Sign-in state lives on the client, so each browser session gets its own for auth
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+        auto_refresh_token=False,
+        persist_session=False
+    ))
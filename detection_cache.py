@@ -0,0 +1,231 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+import metrics
+
+HASH_SIZE = 8
+
+
+def content_hash(image, namespace=""):
+    h = hashlib.sha256(namespace.encode())
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            h.update(f.read())
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        h.update(image)
+    elif isinstance(image, np.ndarray):
+        h.update(f"{image.shape}{image.dtype}".encode())
+        h.update(np.ascontiguousarray(image).data)
+    else:
+        h.update(f"{image.mode}{image.size}".encode())
+        h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def to_pil(image):
+    if isinstance(image, (str, os.PathLike)):
+        return Image.open(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image))
+    if isinstance(image, np.ndarray):
+        # ndarrays follow the OpenCV/Ultralytics BGR convention
+        return Image.fromarray(np.ascontiguousarray(image[..., ::-1]))
+    return image
+
+
+def perceptual_hash(image):
+    # dHash: sign of horizontal gradients on a tiny grayscale thumbnail
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    small = image.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+class DetectionCache:
+    def __init__(self, max_entries=128, max_distance=4, spill_dir=None, max_spilled=1024):
+        self.max_entries = max_entries
+        self.max_distance = max_distance  # Hamming distance that still counts as the same photo
+        self.spill_dir = spill_dir
+        self.max_spilled = max_spilled  # Entries kept on disk, the oldest spills are deleted first
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (namespace, phash, value)
+        self._spilled = OrderedDict()  # key -> None, oldest spill first
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Pick up what earlier processes left behind so the cap covers it too
+            for entry in sorted(os.scandir(spill_dir), key=lambda f: f.stat().st_mtime):
+                key, ext = os.path.splitext(entry.name)
+                if ext in (".json", ".png"):
+                    self._spilled[key] = None
+            self._trim_spilled()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, image, compute, namespace="", decode=None, hash_image=None):
+        # decode turns the raw input into what compute expects, hash_image picks the
+        # PIL image to fingerprint from that (both default to the input as a PIL image)
+        key = content_hash(image, namespace)
+        value = self._get_exact(key)
+        if value is not None:
+            return value
+
+        if decode is not None:
+            decoded = decode(image)
+        else:
+            decoded = image if isinstance(image, np.ndarray) else to_pil(image)
+        phash = perceptual_hash(hash_image(decoded) if hash_image is not None else to_pil(decoded))
+        value = self._get_near(namespace, phash)
+        if value is not None:
+            self._store(key, namespace, phash, value)
+            return value
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("detection_cache_misses")
+        value = compute(decoded)
+        self._store(key, namespace, phash, value)
+        return value
+
+    def get(self, image, namespace="", fingerprint=None):
+        # Exact or near hit without computing anything, for callers that compute asynchronously.
+        # fingerprint is the PIL image to hash perceptually (defaults to the input as a PIL image).
+        key = content_hash(image, namespace)
+        value = self._get_exact(key)
+        if value is not None:
+            return value
+        phash = perceptual_hash(fingerprint if fingerprint is not None else to_pil(image))
+        value = self._get_near(namespace, phash)
+        if value is not None:
+            self._store(key, namespace, phash, value)
+            return value
+        with self._lock:
+            self.misses += 1
+        metrics.inc("detection_cache_misses")
+        return None
+
+    def put(self, image, value, namespace="", fingerprint=None):
+        phash = perceptual_hash(fingerprint if fingerprint is not None else to_pil(image))
+        self._store(content_hash(image, namespace), namespace, phash, value)
+
+    def clear(self):
+        # Spilled entries go too, or exact lookups would keep loading them back
+        with self._lock:
+            self._entries.clear()
+            self._spilled.clear()
+            if self.spill_dir:
+                for entry in os.scandir(self.spill_dir):
+                    if os.path.splitext(entry.name)[1] in (".json", ".png"):
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+
+    def _get_exact(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("detection_cache_hits")
+                return entry[2]
+        entry = self._load_spilled(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            metrics.inc("detection_cache_spill_hits")
+            self._store(key, *entry)
+            return entry[2]
+        return None
+
+    def _get_near(self, namespace, phash):
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key, (entry_namespace, entry_phash, _) in self._entries.items():
+                if entry_namespace != namespace:
+                    continue
+                distance = (phash ^ entry_phash).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            metrics.inc("detection_cache_near_hits")
+            return self._entries[best_key][2]
+
+    def _store(self, key, namespace, phash, value):
+        evicted = []
+        with self._lock:
+            self._entries[key] = (namespace, phash, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        for evicted_key, entry in evicted:
+            self._spill(evicted_key, entry)
+
+    def _spill_paths(self, key):
+        return os.path.join(self.spill_dir, f"{key}.json"), os.path.join(self.spill_dir, f"{key}.png")
+
+    def _spill(self, key, entry):
+        if not self.spill_dir:
+            return
+        namespace, phash, (json_output, output_image) = entry
+        meta_path, image_path = self._spill_paths(key)
+        try:
+            output_image.save(image_path, format="PNG")
+            with open(meta_path, "w") as f:
+                json.dump({"namespace": namespace, "phash": phash, "json_output": json_output}, f)
+        except OSError:
+            # Spilling is best effort, an unwritable disk only costs a future recompute
+            self._remove_spilled(key)
+            return
+        with self._lock:
+            self._spilled[key] = None
+            self._spilled.move_to_end(key)
+        self._trim_spilled()
+
+    def _trim_spilled(self):
+        evicted = []
+        with self._lock:
+            while len(self._spilled) > self.max_spilled:
+                evicted.append(self._spilled.popitem(last=False)[0])
+        for key in evicted:
+            self._remove_spilled(key)
+        metrics.inc("detection_cache_spill_evictions", len(evicted))
+
+    def _remove_spilled(self, key):
+        for path in self._spill_paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        meta_path, image_path = self._spill_paths(key)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            output_image = Image.open(image_path)
+            output_image.load()
+        except (OSError, ValueError):
+            return None
+        # Back in memory now, it is written out again if it gets evicted a second time
+        with self._lock:
+            self._spilled.pop(key, None)
+        self._remove_spilled(key)
+        return meta["namespace"], meta["phash"], (meta["json_output"], output_image)
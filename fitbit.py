@@ -1,51 +1,120 @@
 import requests
 import dotenv
 import os
+import time
+import hashlib
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from supabase import Client
+from storage import as_storage
+import metrics
 # from api_info import update_steps_distance,ensure_daily_entry
 # dotenv.load_dotenv()
 
 
+@metrics.timed("db_get_fitbit_token")
 def get_fitbit_token(supabase:Client,user_id):
-    response = supabase.table("Fitbit_Token").select("*").eq("user_id", user_id).execute()
-    if response.data:
-        return response.data[0]["access_token"]
-    return None
+    return as_storage(supabase).get_fitbit_token(user_id)
 
 
 def todays_date():
     return datetime.today().strftime("%Y-%m-%d")
 
-def steps_covered(access_token):
-    header = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(f'https://api.fitbit.com/1/user/-/activities/date/{todays_date()}.json', headers=header).json()
-    
-    if not response.get('success', True):  # Default to True if 'success' is not in the response
-        return None
+FITBIT_API = "https://api.fitbit.com/1/user/-"
+FITBIT_TIMEOUT = float(os.getenv("FITBIT_TIMEOUT", "5"))
+FITBIT_CACHE_TTL = int(os.getenv("FITBIT_CACHE_TTL", "60"))
+FITBIT_POOL_SIZE = int(os.getenv("FITBIT_POOL_SIZE", "10"))
 
-    # Proceed if the response is successful
-    if 'summary' in response and 'steps' in response['summary']:
-        return response['summary']['steps']
-    else:
-        return None
 
-def dist_covered(access_token):
-    header = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(f'https://api.fitbit.com/1/user/-/activities/date/{todays_date()}.json', headers=header).json()
+class FitbitClient:
+    # One pooled HTTP session and a short-lived per-user cache of the daily summary
+    def __init__(self, ttl=FITBIT_CACHE_TTL, timeout=FITBIT_TIMEOUT, pool_size=FITBIT_POOL_SIZE):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._cache = {}  # (user key, date) -> (fetched_at, etag, summary)
+        self._lock = threading.Lock()
+
+    def daily_summary(self, access_token, date=None):
+        date = date or todays_date()
+        key = (hashlib.sha256(access_token.encode()).hexdigest(), date)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and now - cached[0] < self.ttl:
+            metrics.inc("fitbit_cache_hits")
+            return cached[2]
+        metrics.inc("fitbit_cache_misses")
+
+        header = {'Authorization': f'Bearer {access_token}'}
+        if cached and cached[1]:
+            header['If-None-Match'] = cached[1]
+
+        try:
+            with metrics.span("fitbit_daily_summary"):
+                response = self.session.get(f'{FITBIT_API}/activities/date/{date}.json', headers=header, timeout=self.timeout)
+        except requests.RequestException:
+            metrics.inc("fitbit_errors")
+            # Keep showing the last known numbers rather than stalling the page
+            return cached[2] if cached else None
+
+        if response.status_code == 304 and cached:
+            metrics.inc("fitbit_not_modified")
+            summary = cached[2]
+        else:
+            try:
+                payload = response.json()
+            except ValueError:
+                # An HTML error page or an empty 5xx body, same as a failed request
+                metrics.inc("fitbit_errors")
+                return cached[2] if cached else None
+            if not payload.get('success', True):  # Default to True if 'success' is not in the response
+                return None
+            summary = payload.get('summary')
+
+        with self._lock:
+            self._cache[key] = (now, response.headers.get('ETag'), summary)
+            if len(self._cache) > 1024:
+                self._cache = {k: v for k, v in self._cache.items() if now - v[0] < self.ttl}
+        return summary
+
 
-    if not response.get('success', True):  # Default to True if 'success' is not in the response
+_client = FitbitClient()
+
+
+def daily_summary(access_token):
+    return _client.daily_summary(access_token)
+
+
+def get_fitbit_summary(supabase:Client,user_id):
+    # Token lookup and summary fetch chained so the dashboard can run them off-thread
+    access_token = get_fitbit_token(supabase,user_id)
+    if not access_token:
         return None
+    return daily_summary(access_token)
+
+
+def steps_covered(access_token):
+    summary = daily_summary(access_token)
+    if summary and 'steps' in summary:
+        return summary['steps']
+    return None
 
-    return response['summary']['distances'][0]['distance']
+def dist_covered(access_token):
+    summary = daily_summary(access_token)
+    if summary and summary.get('distances'):
+        return summary['distances'][0]['distance']
+    return None
 
 def cal_burned(access_token):
-    header = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(f'https://api.fitbit.com/1/user/-/activities/date/{todays_date()}.json', headers=header).json()
-    print(response)
-    if not response.get('success', True):  # Default to True if 'success' is not in the response
-        return None
-    return response['summary']['caloriesOut']
+    summary = daily_summary(access_token)
+    if summary:
+        return summary.get('caloriesOut')
+    return None
 
 # if __name__ == '__main__':
 #     # response = requests.get(f'https://api.fitbit.com/1/user/-/activities/date/{todays_date()}.json', headers=header).json()
@@ -0,0 +1,58 @@
+import base64
+import io
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from worker_pool import InferenceBusy
+import metrics
+
+INFERENCE_URL = os.getenv("INFERENCE_URL")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+INFERENCE_POOL_SIZE = int(os.getenv("INFERENCE_POOL_SIZE", "10"))
+
+
+class InferenceClient:
+    # Talks to inference_service.py; food_detect has the same signature and return as ai_model's
+    def __init__(self, url=INFERENCE_URL, timeout=INFERENCE_TIMEOUT, pool_size=INFERENCE_POOL_SIZE):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def food_detect(self, image, annotate=True):
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, "rb") as f:
+                image = f.read()
+
+        with metrics.span("inference_client_detect"):
+            response = self.session.post(
+                f"{self.url}/detect",
+                params={"annotate": "1" if annotate else "0"},
+                data=bytes(image),
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=self.timeout
+            )
+        if response.status_code == 503:
+            raise InferenceBusy(response.json().get("error", "The food detector is busy, please try again in a moment"))
+        if response.status_code != 200:
+            try:
+                error = response.json()["error"]
+            except (ValueError, KeyError):
+                error = response.reason
+            raise ValueError(f"Error detecting food: {error}")
+
+        payload = response.json()
+        output_image = None
+        if payload.get("image"):
+            output_image = Image.open(io.BytesIO(base64.b64decode(payload["image"])))
+        return json.dumps(payload["foods"], indent=4), output_image
+
+    def ready(self) -> bool:
+        try:
+            return self.session.get(f"{self.url}/health", timeout=self.timeout).json()["ready"]
+        except (requests.RequestException, ValueError, KeyError):
+            return False
@@ -0,0 +1,213 @@
+import argparse
+import base64
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from ai_model import DEFAULT_WEIGHTS, MIN_CONFIDENCE, detection_cache, food_detect_batch, model_ready, warmup
+from preprocess import prepare_image
+from worker_pool import INFERENCE_QUEUE_SIZE, INFERENCE_WORKERS, InferenceBusy, InferencePool
+import metrics
+
+MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "5"))
+REQUEST_TIMEOUT = float(os.getenv("INFERENCE_REQUEST_TIMEOUT", "30"))
+JPEG_QUALITY = 90
+
+
+class BatchScheduler:
+    # Dynamic batching: requests that arrive within max_wait_ms of the first one waiting
+    # share a single forward pass, up to max_batch images. With a worker pool, batches run
+    # in the pool's processes and several can be on the model at once. Repeated and
+    # near-identical images are answered from the detection cache without being queued.
+    def __init__(self, weights_path=DEFAULT_WEIGHTS, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, pool=None, cache=detection_cache):
+        self.weights_path = weights_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pool = pool
+        self.cache = cache
+        # Same entries as ai_model.food_detect, so a service in the app's process shares them
+        self.namespace = f"{weights_path}@{MIN_CONFIDENCE}"
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, image, annotate=True) -> Future:
+        # Decode on the caller's thread, overlapping with the batch currently on the model
+        future = Future()
+        self._queue.put((prepare_image(image), annotate, future))
+        metrics.set_gauge("service_queue_depth", self._queue.qsize())
+        return future
+
+    def detect(self, image, prepared, annotate=True, timeout=None) -> dict:
+        # Waits on the caller's thread; the cache is read and written there too, so a spill
+        # to disk never holds up the batches
+        if self.cache is None:
+            return self.submit(prepared, annotate).result(timeout)
+        hit = self.cache.get(image, self.namespace, prepared.model_input)
+        if hit is not None:
+            metrics.inc("service_cache_hits")
+            json_output, output_image = hit
+            return {"foods": json.loads(json_output), "image": output_image}
+        result = self.submit(prepared, annotate).result(timeout)
+        # Entries hold the annotated image, results detected without one are not kept
+        if result["image"] is not None:
+            self.cache.put(image, (json.dumps(result["foods"], indent=4), result["image"]), self.namespace, prepared.model_input)
+        return result
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            metrics.set_gauge("service_queue_depth", self._queue.qsize())
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        metrics.inc("service_batches")
+        metrics.inc("service_images", len(batch))
+        annotate = any(annotate for _, annotate, _ in batch)
+        if self.pool is not None:
+            try:
+                pool_future = self.pool.food_detect_batch([prepared for prepared, _, _ in batch], annotate)
+            except InferenceBusy as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                return
+            pool_future.add_done_callback(lambda done: self._resolve(batch, done))
+            return
+
+        try:
+            with metrics.span("service_batch"):
+                results = food_detect_batch(
+                    [prepared for prepared, _, _ in batch],
+                    batch_size=len(batch),
+                    weights_path=self.weights_path,
+                    annotate=annotate
+                )
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _resolve(self, batch, pool_future):
+        if pool_future.exception() is not None:
+            for _, _, future in batch:
+                future.set_exception(pool_future.exception())
+            return
+        for (_, _, future), result in zip(batch, pool_future.result()):
+            future.set_result(result)
+
+
+def encode_image(image) -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class _InferenceHandler(BaseHTTPRequestHandler):
+    scheduler = None
+    weights_path = DEFAULT_WEIGHTS
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            pool = self.scheduler.pool
+            self._send_json(200, {"ready": pool.ready() if pool is not None else model_ready(self.weights_path)})
+        elif path == "/metrics":
+            self._send(200, metrics.render_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/detect":
+            self.send_error(404)
+            return
+        annotate = parse_qs(url.query).get("annotate", ["1"])[0] != "0"
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        try:
+            prepared = prepare_image(body)
+        except Exception as e:
+            # Anything PIL cannot open is the caller's fault
+            self._send_json(400, {"error": f"Error decoding image: {str(e)}"})
+            return
+        try:
+            result = self.scheduler.detect(body, prepared, annotate, REQUEST_TIMEOUT)
+        except InferenceBusy as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"Error detecting food: {str(e)}"})
+            return
+
+        payload = {"foods": result["foods"]}
+        if annotate and result["image"] is not None:
+            payload["image"] = encode_image(result["image"])
+        self._send_json(200, payload)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload), "application/json", headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        body = body.encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(scheduler, host="127.0.0.1", port=8600):
+    handler = type("InferenceHandler", (_InferenceHandler,), {
+        "scheduler": scheduler,
+        "weights_path": scheduler.weights_path
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the food detector over HTTP with dynamic batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS, help="inference worker processes, 0 runs the model in this process")
+    parser.add_argument("--queue-size", type=int, default=INFERENCE_QUEUE_SIZE, help="batches allowed to wait for a worker before requests get 503")
+    args = parser.parse_args()
+
+    pool = None
+    if args.workers > 0:
+        # Serve /health while the workers warm up, it reports ready once they all have
+        pool = InferencePool(args.weights, args.workers, args.queue_size, wait=False)
+    else:
+        warmup(args.weights)
+    scheduler = BatchScheduler(args.weights, args.max_batch, args.max_wait_ms, pool)
+    server = make_server(scheduler, args.host, args.port)
+    print(f"Serving {args.weights} on http://{args.host}:{args.port} (max batch {args.max_batch}, wait {args.max_wait_ms} ms)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
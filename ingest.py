@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ai_model import DEFAULT_WEIGHTS, food_detect_batch
+from nutrition import NutritionIndex, meal_nutrition
+from preprocess import prepare_image
+from storage import SQLiteStorage, as_storage
+import metrics
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+# Stable namespace so re-ingesting the same file backfills the same Meals row
+BACKFILL_NAMESPACE = uuid.UUID("5d9f4b62-4a6e-4c57-9a43-0d6f7c1b2e38")
+
+
+def walk_images(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def load_checkpoint(path):
+    # Each line commits the paths whose rows are safely in the output, plus the writer's offset
+    # after them: the JSONL byte offset, or the index of the next Parquet part
+    done, offset = set(), None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Torn final line from a crash mid-write
+                done.update(entry["done"])
+                offset = entry.get("offset")
+    return done, offset
+
+
+def append_checkpoint(path, done, offset):
+    with open(path, "a") as f:
+        f.write(json.dumps({"done": done, "offset": offset}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class JsonlWriter:
+    def __init__(self, path, offset=None):
+        self.file = open(path, "ab")
+        # Drop rows a crashed run wrote after its last checkpoint, or any old output on a fresh run
+        self.file.truncate(offset or 0)
+        self.file.seek(0, os.SEEK_END)
+        self.position = self.file.tell()
+
+    def write(self, rows) -> bool:
+        for row in rows:
+            self.file.write((json.dumps(row) + "\n").encode())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.position = self.file.tell()
+        return True
+
+    def offset(self):
+        return self.position
+
+    def close(self) -> bool:
+        self.file.close()
+        return True
+
+
+class ParquetWriter:
+    # Parquet files are only readable once closed, so rows go out as complete part files
+    def __init__(self, directory, part_rows=1000, offset=None):
+        self.directory = directory
+        self.part_rows = part_rows
+        self.rows = []
+        os.makedirs(directory, exist_ok=True)
+        # Continue from the part after the last checkpoint. A part written after it (a crash
+        # between the rename and the checkpoint) holds rows that are redone, so it is overwritten;
+        # a fresh run drops any old parts, like JsonlWriter truncating its file.
+        self.part = offset or 0
+        for name in os.listdir(directory):
+            index = name.split(".")[0][len("part-"):]
+            if name.startswith("part-") and index.isdigit() and int(index) >= self.part:
+                os.remove(os.path.join(directory, name))
+
+    def write(self, rows) -> bool:
+        self.rows.extend(rows)
+        if len(self.rows) < self.part_rows:
+            return False
+        self._flush()
+        return True
+
+    def offset(self):
+        return self.part
+
+    def close(self) -> bool:
+        if self.rows:
+            self._flush()
+        return True
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # One explicit schema for every part: inferred types drift with the data (an all-error
+        # part has null timestamps, an int meal_cal in one part is a double in the next).
+        # Nested columns go in as JSON text so they fit it whatever was detected.
+        schema = pa.schema([
+            ("path", pa.string()),
+            ("timestamp", pa.string()),
+            ("foods", pa.string()),
+            ("nutrition", pa.string()),
+            ("meal_cal", pa.float64()),
+            ("error", pa.string())
+        ])
+        table = pa.Table.from_pylist([
+            {**row, "foods": json.dumps(row["foods"]), "nutrition": json.dumps(row["nutrition"]), "meal_cal": float(row["meal_cal"])}
+            for row in self.rows
+        ], schema=schema)
+        tmp_path = os.path.join(self.directory, f"part-{self.part:05d}.parquet.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, tmp_path[:-len(".tmp")])
+        self.part += 1
+        self.rows = []
+
+
+def meal_timestamp(path):
+    # Backfilled meals are dated by the photo's modification time, in the same format as timestampz()
+    return datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S.%f')[:-1] + '+00'
+
+
+def backfill_rows(rows, user_id):
+    meals = []
+    for row in rows:
+        if not row.get("nutrition"):
+            continue
+        meals.append({
+            "user_id": user_id,
+            "date": row["timestamp"][:10],
+            "timestamp": row["timestamp"],
+            "meal_cal": row["meal_cal"],
+            "foods_detected": [
+                {
+                    "food_name": item["food"],
+                    "count": item["portion"],
+                    "calories": item["calories_servings"],
+                    "grams": None,
+                    "confidence": item["confidence"]
+                }
+                for item in row["nutrition"]
+            ],
+            "request_id": str(uuid.uuid5(BACKFILL_NAMESPACE, os.path.abspath(row["path"])))
+        })
+    return meals
+
+
+def _decode(path):
+    try:
+        return prepare_image(path), None
+    except Exception as e:
+        return None, f"Error decoding image: {str(e)}"
+
+
+def ingest(paths, writer, storage, index, weights_path=DEFAULT_WEIGHTS, batch_size=16, decode_workers=4, checkpoint=None, backfill_user=None):
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    pending = []
+    processed = 0
+    with ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="ingest-decode") as pool:
+        # Decode the next batch on the pool while the current one is on the model
+        decoding = [pool.submit(_decode, path) for path in batches[0]] if batches else []
+        for i, batch in enumerate(batches):
+            decoded = [future.result() for future in decoding]
+            if i + 1 < len(batches):
+                decoding = [pool.submit(_decode, path) for path in batches[i + 1]]
+
+            rows = []
+            ready = [(path, prepared) for path, (prepared, error) in zip(batch, decoded) if prepared is not None]
+            with metrics.span("ingest_batch"):
+                results = food_detect_batch([prepared for _, prepared in ready], batch_size=batch_size, weights_path=weights_path, annotate=False) if ready else []
+            detections = {path: result["foods"] for (path, _), result in zip(ready, results)}
+            for path, (prepared, error) in zip(batch, decoded):
+                if error is not None:
+                    rows.append({"path": path, "timestamp": None, "foods": [], "nutrition": [], "meal_cal": 0, "error": error})
+                    continue
+                nutrition = meal_nutrition(detections[path], index)
+                rows.append({
+                    "path": path,
+                    "timestamp": meal_timestamp(path),
+                    "foods": detections[path],
+                    "nutrition": nutrition,
+                    "meal_cal": sum(item["calories_servings"] for item in nutrition),
+                    "error": None
+                })
+
+            if backfill_user:
+                meals = backfill_rows(rows, backfill_user)
+                if meals:
+                    storage.save_meals(meals)
+
+            metrics.inc("ingest_images", len(batch))
+            pending.extend(batch)
+            if writer.write(rows) and checkpoint:
+                append_checkpoint(checkpoint, pending, writer.offset())
+                pending = []
+            processed += len(batch)
+            print(f"{processed}/{len(paths)} images", flush=True)
+
+    if writer.close() and checkpoint and pending:
+        append_checkpoint(checkpoint, pending, writer.offset())
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect foods and estimate calories for every image under a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--output", default="ingest_results.jsonl", help="a .jsonl file, or a .parquet directory of part files")
+    parser.add_argument("--checkpoint", default=None, help="defaults to <output>.checkpoint; rerun with the same one to resume")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--part-rows", type=int, default=1000, help="rows per Parquet part file")
+    parser.add_argument("--db", default=None, help="SQLite database to use instead of Supabase")
+    parser.add_argument("--backfill-user", default=None, help="also save each detected meal to Meals for this user_id")
+    args = parser.parse_args()
+
+    if args.db:
+        storage = SQLiteStorage(args.db)
+    else:
+        from db import get_supabase
+        storage = as_storage(get_supabase())
+    index = NutritionIndex(storage)
+
+    checkpoint = args.checkpoint or f"{args.output.rstrip(os.sep)}.checkpoint"
+    done, offset = load_checkpoint(checkpoint)
+    paths = [path for path in walk_images(args.directory) if path not in done]
+    if done:
+        print(f"Resuming: {len(done)} images already done")
+
+    if args.output.rstrip(os.sep).endswith(".parquet"):
+        writer = ParquetWriter(args.output, args.part_rows, offset)
+    else:
+        writer = JsonlWriter(args.output, offset)
+    ingest(paths, writer, storage, index, args.weights, args.batch_size, args.decode_workers, checkpoint, args.backfill_user)
+
+
+if __name__ == "__main__":
+    main()
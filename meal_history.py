@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+import os
+import pandas as pd
+from supabase import Client
+from storage import as_storage
+import metrics
+
+HISTORY_COLUMNS = ["id", "timestamp", "meal_cal", "foods_detected"]
+
+# Fields of each structured record in Meals.foods_detected
+FOOD_COLUMNS = ["food_name", "count", "calories", "grams", "confidence"]
+
+# Look-back for each history filter; None means no lower bound
+HISTORY_WINDOWS = {
+    "Last 24 Hours": timedelta(days=1),
+    "Last Week": timedelta(weeks=1),
+    "Last Month": timedelta(days=30),
+    "All Time": None,
+}
+
+# The trend and distribution charts always show the last 24 hours
+DASHBOARD_WINDOW = timedelta(days=1)
+
+# Rows per Meals request, history is walked page by page on a (timestamp, id) cursor
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "200"))
+
+
+def history_window(time_filter):
+    window = HISTORY_WINDOWS.get(time_filter)
+    # The single fetch has to cover both the charts and the history table
+    return None if window is None else max(window, DASHBOARD_WINDOW)
+
+
+def meal_history_frame(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+    # Timestamps are stored as local wall-clock time tagged +00, compare them as naive datetimes
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True, format="ISO8601").dt.tz_localize(None)
+    df["meal_cal"] = pd.to_numeric(df["meal_cal"])
+    df["foods_detected"] = df["foods_detected"].map(lambda foods: foods or [])
+    return df
+
+
+@metrics.timed("db_fetch_meals_page")
+def fetch_meals_page(supabase:Client, user_id, since=None, before=None, limit=HISTORY_PAGE_SIZE) -> list:
+    # Latest first; `before` is the (timestamp, id) keyset cursor of the last row seen
+    try:
+        return as_storage(supabase).list_meals(user_id, HISTORY_COLUMNS, since=since, before=before, limit=limit)
+    except Exception as e:
+        raise ValueError(f"Error fetching meal history: {str(e)}")
+
+
+def _is_before(timestamp, window):
+    return pd.to_datetime(timestamp, utc=True).tz_localize(None) < datetime.now() - window
+
+
+def load_meal_history(supabase:Client, user_id, time_filter, boundary=None):
+    # Returns the history frame plus a cursor for older pages (None once everything is loaded).
+    # Bounded filters read their whole window, "All Time" reads only the newest pages, or
+    # everything from the `boundary` cursor's timestamp onwards when older pages were already
+    # loaded on demand (rows on both sides of it are told apart by id).
+    window = history_window(time_filter)
+    if window is not None:
+        # Whole hours keep the query identical across reruns so the read cache can serve it;
+        # the frame is trimmed to the exact window by slice_history
+        since = (datetime.now() - window).replace(minute=0, second=0, microsecond=0).isoformat()
+    else:
+        since = boundary[0] if boundary else None
+
+    rows = []
+    before = None
+    while True:
+        page = fetch_meals_page(supabase, user_id, since=since, before=before)
+        rows.extend(page)
+        if len(page) < HISTORY_PAGE_SIZE:
+            return meal_history_frame(rows), None
+        before = (page[-1]["timestamp"], page[-1]["id"])
+        # Unbounded history stops once the dashboard charts are covered
+        if since is None and _is_before(before[0], DASHBOARD_WINDOW):
+            return meal_history_frame(rows), before
+
+
+def load_older_meals(supabase:Client, user_id, before):
+    rows = fetch_meals_page(supabase, user_id, before=before)
+    cursor = (rows[-1]["timestamp"], rows[-1]["id"]) if len(rows) == HISTORY_PAGE_SIZE else None
+    return meal_history_frame(rows), cursor
+
+
+def per_meal_charts(time_filter):
+    # Rollups are per calendar day, so a 24-hour window read from them would span two days
+    # (up to 48 hours); windows of a day or less are charted from the meals themselves
+    window = HISTORY_WINDOWS.get(time_filter)
+    return window is not None and window <= DASHBOARD_WINDOW
+
+
+def rollup_since(time_filter):
+    # First date whose rollup rows fall inside the filter window
+    window = HISTORY_WINDOWS.get(time_filter)
+    if window is None:
+        return None
+    return (datetime.now() - window).strftime("%Y-%m-%d")
+
+
+def rollup_food_totals(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["date", "food_name", "count", "calories"])
+    df["count"] = pd.to_numeric(df["count"])
+    df["calories"] = pd.to_numeric(df["calories"])
+    return df.groupby("food_name")[["count", "calories"]].sum()
+
+
+def rollup_daily_totals(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["date", "cal_consumed"])
+    df["date"] = pd.to_datetime(df["date"])
+    df["cal_consumed"] = pd.to_numeric(df["cal_consumed"])
+    return df
+
+
+def slice_history(df: pd.DataFrame, window) -> pd.DataFrame:
+    if window is None:
+        return df
+    return df[df["timestamp"] >= datetime.now() - window]
+
+
+def filter_history(df: pd.DataFrame, time_filter) -> pd.DataFrame:
+    return slice_history(df, HISTORY_WINDOWS.get(time_filter))
+
+
+def food_records(df: pd.DataFrame) -> pd.DataFrame:
+    # One row per detected food, indexed by the meal it belongs to
+    foods = df["foods_detected"].explode().dropna()
+    records = pd.DataFrame(foods.tolist(), index=foods.index, columns=FOOD_COLUMNS)
+    for column in FOOD_COLUMNS[1:]:
+        records[column] = pd.to_numeric(records[column])
+    return records
+
+
+def meal_food_totals(df: pd.DataFrame) -> pd.DataFrame:
+    # Same frame as rollup_food_totals, from the meals in df
+    return food_records(df).groupby("food_name")[["count", "calories"]].sum()
+
+
+def foods_summary(df: pd.DataFrame) -> pd.Series:
+    # "rice x2 (260 kcal), dal x1 (120 kcal)" per meal, for the history table
+    records = food_records(df)
+    labels = (
+        records["food_name"] + " x" + records["count"].fillna(1).astype(int).astype(str)
+        + " (" + records["calories"].fillna(0).round().astype(int).astype(str) + " kcal)"
+    )
+    return labels.groupby(level=0).agg(", ".join).reindex(df.index, fill_value="")
@@ -0,0 +1,140 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "smartbite"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_spans = {}  # name -> [count, total seconds, per-bucket counts]
+
+
+def inc(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    with _lock:
+        span_stats = _spans.get(name)
+        if span_stats is None:
+            span_stats = _spans[name] = [0, 0.0, [0] * len(BUCKETS)]
+        span_stats[0] += 1
+        span_stats[1] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                span_stats[2][i] += 1
+                break
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "spans": {
+                name: {"count": count, "sum_seconds": total, "mean_ms": total / count * 1000 if count else 0.0}
+                for name, (count, total, _) in _spans.items()
+            },
+        }
+
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        for name, value in sorted(_gauges.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        if _spans:
+            lines.append(f"# TYPE {PREFIX}_span_seconds histogram")
+        for name, (count, total, buckets) in sorted(_spans.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {total}')
+            lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_json(path):
+    # Write to a sibling file first so readers never see a half-written snapshot
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot(), f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"):
+    # Loopback only by default, pass host="0.0.0.0" to let a remote scraper in
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_json_writer(path, interval=15.0):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_json(path)
+            except OSError:
+                pass
+    thread = threading.Thread(target=loop, name="metrics-json", daemon=True)
+    thread.start()
+    return thread
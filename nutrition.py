@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from supabase import Client
+from storage import as_storage
+import metrics
+
+NUTRITION_TTL = int(os.getenv("NUTRITION_TTL", "3600"))
+
+class NutritionIndex:
+    # In-memory copy of the CALORIES table, refreshed every `ttl` seconds
+    def __init__(self, supabase: Client, ttl: int = NUTRITION_TTL):
+        self.storage = as_storage(supabase)
+        self.ttl = ttl
+        self._foods = {}  # food_name -> row, or None for names known to be missing
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            with metrics.span("nutrition_refresh"):
+                rows = self.storage.get_calories()
+        except Exception as e:
+            raise ValueError(f"Error loading CALORIES: {str(e)}")
+        foods = {row["food_name"]: row for row in rows}
+        with self._lock:
+            self._foods = foods
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def lookup_many(self, food_names) -> dict:
+        if self.is_stale():
+            self.refresh()
+
+        food_names = set(food_names)
+        foods = self._foods
+        misses = [name for name in food_names if name not in foods]
+
+        metrics.inc("nutrition_index_hits", len(food_names) - len(misses))
+        metrics.inc("nutrition_index_misses", len(misses))
+
+        # Rows added after the last refresh are picked up with one bulk query
+        if misses:
+            try:
+                with metrics.span("nutrition_bulk_lookup"):
+                    rows = self.storage.get_calories(misses)
+            except Exception as e:
+                raise ValueError(f"Error fetching CALORIES: {str(e)}")
+            found = {row["food_name"]: row for row in rows}
+            with self._lock:
+                for name in misses:
+                    self._foods[name] = found.get(name)
+            foods = self._foods
+
+        return {name: foods[name] for name in food_names if foods.get(name)}
+
+    def lookup(self, food_name: str) -> dict:
+        return self.lookup_many([food_name]).get(food_name, {})
+
+
+def meal_nutrition(detections, index: NutritionIndex) -> list:
+    # Per-food calories for a food_detect result, with zero per-food queries.
+    # Foods below the confidence cut were already dropped by food_detect.
+    rows = index.lookup_many(item["food_name"] for item in detections)
+
+    result = []
+    for item in detections:
+        row = rows.get(item["food_name"], {})
+        result.append({
+            "food": item["food_name"],
+            "calories_servings": (row.get("servings") or 0) * item["food_count"],
+            "calories_grams": row.get("grams") or 0,
+            "portion": item["food_count"],
+            "confidence": item["confidence"]
+        })
+    return result
@@ -0,0 +1,100 @@
+import argparse
+import glob
+import json
+import os
+from ultralytics import YOLO
+from ai_model import backend_weights, food_detect_batch
+
+PARITY_CONF_TOLERANCE = 0.05
+
+
+def export_onnx(weights_path="last.pt", imgsz=640, int8=False):
+    # Dynamic axes so food_detect_batch can send several images per forward pass
+    onnx_path = YOLO(weights_path, task="detect").export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    expected = backend_weights(weights_path, "onnx")
+    if os.path.abspath(onnx_path) != os.path.abspath(expected):
+        os.replace(onnx_path, expected)
+    if not int8:
+        return expected
+    return quantize_int8(expected, backend_weights(weights_path, "onnx-int8"))
+
+
+def quantize_int8(onnx_path, int8_path):
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # Weights to INT8, activations quantized on the fly; no calibration set needed
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+
+    # Ultralytics reads class names, stride and image size from the model metadata
+    source = onnx.load(onnx_path, load_external_data=False)
+    quantized = onnx.load(int8_path)
+    existing = {prop.key for prop in quantized.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+
+def _by_food(foods):
+    return {item["food_name"]: item for item in foods}
+
+
+def parity_check(images, reference="last.pt", candidate=None, conf_tolerance=PARITY_CONF_TOLERANCE, batch_size=8):
+    # Same images through both backends: identical foods and counts, confidences within tolerance
+    candidate = candidate or backend_weights(reference, "onnx")
+    reference_results = food_detect_batch(images, batch_size=batch_size, weights_path=reference, annotate=False)
+    candidate_results = food_detect_batch(images, batch_size=batch_size, weights_path=candidate, annotate=False)
+
+    mismatches = []
+    max_delta = 0.0
+    for i, (expected, actual) in enumerate(zip(reference_results, candidate_results)):
+        expected_foods = _by_food(expected["foods"])
+        actual_foods = _by_food(actual["foods"])
+        if expected_foods.keys() != actual_foods.keys():
+            mismatches.append({"image": i, "reason": "foods", "reference": sorted(expected_foods), "candidate": sorted(actual_foods)})
+            continue
+        for name, item in expected_foods.items():
+            if item["food_count"] != actual_foods[name]["food_count"]:
+                mismatches.append({
+                    "image": i, "reason": "count", "food_name": name,
+                    "reference": item["food_count"], "candidate": actual_foods[name]["food_count"]
+                })
+            delta = abs(item["confidence"] - actual_foods[name]["confidence"])
+            max_delta = max(max_delta, delta)
+            if delta > conf_tolerance:
+                mismatches.append({"image": i, "reason": "confidence", "food_name": name, "delta": delta})
+
+    return {
+        "reference": reference,
+        "candidate": candidate,
+        "images": len(reference_results),
+        "max_confidence_delta": max_delta,
+        "mismatches": mismatches,
+        "passed": not mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the food detector to ONNX and check parity with PyTorch")
+    parser.add_argument("--weights", default="last.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--int8", action="store_true", help="also write an INT8 dynamically quantized model")
+    parser.add_argument("--images", default="public", help="directory of images for the parity check")
+    parser.add_argument("--tolerance", type=float, default=PARITY_CONF_TOLERANCE)
+    args = parser.parse_args()
+
+    candidate = export_onnx(args.weights, args.imgsz, args.int8)
+    print(f"Exported {candidate}")
+
+    images = sorted(glob.glob(os.path.join(args.images, "*.jp*g")) + glob.glob(os.path.join(args.images, "*.png")))
+    if images:
+        report = parity_check(images, args.weights, candidate, args.tolerance)
+        print(json.dumps(report, indent=4))
+        if not report["passed"]:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
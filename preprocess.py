@@ -0,0 +1,51 @@
+import io
+import os
+import numpy as np
+from PIL import Image, ImageOps
+
+INFERENCE_SIZE = int(os.getenv("INFERENCE_SIZE", "640"))
+DISPLAY_SIZE = int(os.getenv("DISPLAY_SIZE", "1280"))
+
+
+class PreparedImage:
+    # Display-sized image for annotation plus the model-sized copy actually sent to the detector
+    def __init__(self, display, model_input):
+        self.display = display
+        self.model_input = model_input
+        self.scale = display.width / model_input.width  # model_input coords -> display coords
+
+
+def decode_image(image, display_size=DISPLAY_SIZE):
+    if isinstance(image, np.ndarray):
+        # ndarrays follow the OpenCV/Ultralytics BGR convention
+        return Image.fromarray(np.ascontiguousarray(image[..., ::-1]))
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, (str, os.PathLike)):
+        image = Image.open(image)
+
+    # JPEG draft mode lets libjpeg decode straight at 1/2, 1/4 or 1/8 scale,
+    # so a 12 MP upload is never materialised at full resolution
+    if image.format == "JPEG":
+        image.draft("RGB", (display_size, display_size))
+    return ImageOps.exif_transpose(image)
+
+
+def prepare_image(image, imgsz=INFERENCE_SIZE, display_size=DISPLAY_SIZE):
+    if isinstance(image, PreparedImage):
+        return image
+
+    display = decode_image(image, display_size)
+    if display.mode != "RGB":
+        display = display.convert("RGB")
+    if max(display.size) > display_size:
+        display.thumbnail((display_size, display_size), Image.BILINEAR, reducing_gap=2.0)
+
+    # One resize to the inference size; the detector only letterboxes from here
+    ratio = imgsz / max(display.size)
+    if ratio < 1:
+        size = (max(1, round(display.width * ratio)), max(1, round(display.height * ratio)))
+        model_input = display.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    else:
+        model_input = display
+    return PreparedImage(display, model_input)
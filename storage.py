@@ -0,0 +1,470 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from supabase import Client
+import metrics
+
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "300"))
+READ_CACHE_USERS = int(os.getenv("READ_CACHE_USERS", "1000"))
+
+
+class Storage(ABC):
+    # Repository interface for the Daily, Meals, Daily_Foods, CALORIES and Fitbit_Token tables
+
+    @abstractmethod
+    def get_all(self, table_name: str) -> list:
+        ...
+
+    @abstractmethod
+    def get_daily(self, user_id, date) -> dict:
+        ...
+
+    @abstractmethod
+    def get_user_daily(self, user_id) -> dict:
+        ...
+
+    @abstractmethod
+    def insert_daily(self, row: dict):
+        ...
+
+    @abstractmethod
+    def list_daily(self, user_id, since_date=None) -> list:
+        ...
+
+    @abstractmethod
+    def insert_meal(self, row: dict):
+        ...
+
+    @abstractmethod
+    def save_meal(self, row: dict) -> dict:
+        # Atomic: ensure the Daily row, insert the meal once per request_id, return the Daily row
+        ...
+
+    def save_meals(self, rows: list) -> list:
+        # Same as save_meal for several meals; backends override to write them in one round trip
+        return [self.save_meal(row) for row in rows]
+
+    @abstractmethod
+    def list_meals(self, user_id, columns, since=None, before=None, limit=None) -> list:
+        # Latest first, ordered by (timestamp, id); `before` is a (timestamp, id) keyset cursor
+        ...
+
+    @abstractmethod
+    def list_food_totals(self, user_id, since_date=None) -> list:
+        ...
+
+    @abstractmethod
+    def get_calories(self, food_names=None) -> list:
+        ...
+
+    @abstractmethod
+    def get_fitbit_token(self, user_id):
+        ...
+
+    @abstractmethod
+    def save_fitbit_token(self, user_id, access_token):
+        ...
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, supabase: Client):
+        self.supabase = supabase
+
+    def get_all(self, table_name):
+        return self.supabase.table(table_name).select("*").execute().data
+
+    def get_daily(self, user_id, date):
+        response = self.supabase.table("Daily").select("*").eq("user_id", user_id).eq("date", date).execute()
+        return response.data[0] if response.data else None
+
+    def get_user_daily(self, user_id):
+        response = self.supabase.table("Daily").select("*").eq("user_id", user_id).execute()
+        return response.data[0] if response.data else None
+
+    def insert_daily(self, row):
+        self.supabase.table("Daily").insert(row).execute()
+
+    def list_daily(self, user_id, since_date=None):
+        query = self.supabase.table("Daily").select("date, cal_consumed").eq("user_id", user_id)
+        if since_date:
+            query = query.gte("date", since_date)
+        return query.order("date").execute().data
+
+    def insert_meal(self, row):
+        # Daily.cal_consumed and Daily_Foods are maintained by triggers on Meals
+        self.supabase.table("Meals").insert(row).execute()
+
+    def save_meal(self, row):
+        response = self.supabase.rpc("save_meal", {
+            "p_user_id": row["user_id"],
+            "p_date": row["date"],
+            "p_timestamp": row["timestamp"],
+            "p_meal_cal": row["meal_cal"],
+            "p_foods_detected": row["foods_detected"],
+            "p_request_id": row["request_id"]
+        }).execute()
+        return response.data[0] if response.data else None
+
+    def save_meals(self, rows):
+        return self.supabase.rpc("save_meals", {"p_meals": rows}).execute().data
+
+    def list_meals(self, user_id, columns, since=None, before=None, limit=None):
+        query = self.supabase.table("Meals").select(", ".join(columns)).eq("user_id", user_id)
+        if since is not None:
+            query = query.gte("timestamp", since)
+        if before is not None:
+            timestamp, meal_id = before
+            query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt.{int(meal_id)})')
+        query = query.order("timestamp", desc=True).order("id", desc=True)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.execute().data
+
+    def list_food_totals(self, user_id, since_date=None):
+        query = self.supabase.table("Daily_Foods").select("date, food_name, count, calories").eq("user_id", user_id)
+        if since_date:
+            query = query.gte("date", since_date)
+        return query.execute().data
+
+    def get_calories(self, food_names=None):
+        query = self.supabase.table("CALORIES").select("food_name, servings, grams")
+        if food_names is not None:
+            query = query.in_("food_name", list(food_names))
+        return query.execute().data
+
+    def get_fitbit_token(self, user_id):
+        response = self.supabase.table("Fitbit_Token").select("*").eq("user_id", user_id).execute()
+        if response.data:
+            return response.data[0]["access_token"]
+        return None
+
+    def save_fitbit_token(self, user_id, access_token):
+        response = self.supabase.table("Fitbit_Token").select("*").eq("user_id", user_id).execute()
+        if response.data:
+            # User has a token, update it
+            self.supabase.table("Fitbit_Token").update({
+                "access_token": access_token,
+                "updated_at": "now()"
+            }).eq("user_id", user_id).execute()
+        else:
+            # User does not have a token, insert new record
+            self.supabase.table("Fitbit_Token").insert({
+                "user_id": user_id,
+                "access_token": access_token
+            }).execute()
+
+
+SQLITE_SCHEMA = """
+create table if not exists Daily (
+    user_id text not null,
+    date text not null,
+    cal_consumed real not null default 0,
+    cal_burnt real not null default 0,
+    steps integer not null default 0,
+    distance real not null default 0,
+    primary key (user_id, date)
+);
+create table if not exists Meals (
+    id integer primary key autoincrement,
+    user_id text not null,
+    date text not null,
+    timestamp text not null,
+    meal_cal real not null default 0,
+    foods_detected text not null default '[]',
+    request_id text unique
+);
+create index if not exists meals_user_timestamp on Meals (user_id, timestamp);
+create table if not exists Daily_Foods (
+    user_id text not null,
+    date text not null,
+    food_name text not null,
+    count integer not null default 0,
+    calories real not null default 0,
+    primary key (user_id, date, food_name)
+);
+create table if not exists CALORIES (
+    food_name text primary key,
+    servings real,
+    grams real
+);
+create table if not exists Fitbit_Token (
+    user_id text primary key,
+    access_token text not null,
+    updated_at text
+);
+"""
+
+
+def _sortable_timestamp(timestamp):
+    # Store timestamps in one text layout so range filters compare correctly
+    if timestamp.endswith("+00"):
+        timestamp += ":00"
+    parsed = datetime.fromisoformat(timestamp)
+    return parsed.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class SQLiteStorage(Storage):
+    # Local stand-in with the same semantics as the Supabase schema, triggers included
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        with self._lock, self.conn:
+            self.conn.execute(sql, params)
+
+    def get_all(self, table_name):
+        return self._query(f'select * from "{table_name}"')
+
+    def get_daily(self, user_id, date):
+        rows = self._query("select * from Daily where user_id = ? and date = ?", (user_id, date))
+        return rows[0] if rows else None
+
+    def get_user_daily(self, user_id):
+        rows = self._query("select * from Daily where user_id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def insert_daily(self, row):
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        self._execute(f"insert into Daily ({columns}) values ({placeholders})", tuple(row.values()))
+
+    def list_daily(self, user_id, since_date=None):
+        sql = "select date, cal_consumed from Daily where user_id = ?"
+        params = [user_id]
+        if since_date:
+            sql += " and date >= ?"
+            params.append(since_date)
+        return self._query(sql + " order by date", params)
+
+    def insert_meal(self, row):
+        with self._lock, self.conn:
+            self._insert_meal(row)
+
+    def save_meal(self, row):
+        with self._lock, self.conn:
+            return self._save_meal(row)
+
+    def save_meals(self, rows):
+        with self._lock, self.conn:
+            return [self._save_meal(row) for row in rows]
+
+    def _save_meal(self, row):
+        # Caller holds the lock and the open transaction
+        self.conn.execute(
+            """insert into Daily (user_id, date, cal_consumed, cal_burnt, steps, distance)
+            values (?, ?, 0, 0, 0, 0) on conflict (user_id, date) do nothing""",
+            (row["user_id"], row["date"])
+        )
+        seen = self.conn.execute("select 1 from Meals where request_id = ?", (row["request_id"],)).fetchone()
+        if not seen:
+            self._insert_meal(row)
+        daily = self.conn.execute(
+            "select * from Daily where user_id = ? and date = ?", (row["user_id"], row["date"])
+        ).fetchone()
+        return dict(daily)
+
+    def _insert_meal(self, row):
+        # Caller holds the lock and the open transaction
+        foods = row.get("foods_detected") or []
+        self.conn.execute(
+            "insert into Meals (user_id, date, timestamp, meal_cal, foods_detected, request_id) values (?, ?, ?, ?, ?, ?)",
+            (row["user_id"], row["date"], _sortable_timestamp(row["timestamp"]), row["meal_cal"], json.dumps(foods), row.get("request_id"))
+        )
+        # Same bookkeeping the Supabase triggers do for Daily and Daily_Foods
+        self.conn.execute(
+            "update Daily set cal_consumed = cal_consumed + ? where user_id = ? and date = ?",
+            (row["meal_cal"], row["user_id"], row["date"])
+        )
+        for food in foods:
+            self.conn.execute(
+                """insert into Daily_Foods (user_id, date, food_name, count, calories) values (?, ?, ?, ?, ?)
+                on conflict (user_id, date, food_name) do update
+                set count = count + excluded.count, calories = calories + excluded.calories""",
+                (row["user_id"], row["date"], food["food_name"], food.get("count") or 1, food.get("calories") or 0)
+            )
+
+    def list_meals(self, user_id, columns, since=None, before=None, limit=None):
+        sql = f"select {', '.join(columns)} from Meals where user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " and timestamp >= ?"
+            params.append(_sortable_timestamp(since))
+        if before is not None:
+            timestamp, meal_id = before
+            sql += " and (timestamp < ? or (timestamp = ? and id < ?))"
+            params.extend([_sortable_timestamp(timestamp), _sortable_timestamp(timestamp), meal_id])
+        sql += " order by timestamp desc, id desc"
+        if limit is not None:
+            sql += " limit ?"
+            params.append(limit)
+        rows = self._query(sql, params)
+        for row in rows:
+            if "foods_detected" in row:
+                row["foods_detected"] = json.loads(row["foods_detected"])
+        return rows
+
+    def list_food_totals(self, user_id, since_date=None):
+        sql = "select date, food_name, count, calories from Daily_Foods where user_id = ?"
+        params = [user_id]
+        if since_date:
+            sql += " and date >= ?"
+            params.append(since_date)
+        return self._query(sql, params)
+
+    def get_calories(self, food_names=None):
+        if food_names is None:
+            return self._query("select food_name, servings, grams from CALORIES")
+        food_names = list(food_names)
+        placeholders = ", ".join("?" for _ in food_names)
+        return self._query(f"select food_name, servings, grams from CALORIES where food_name in ({placeholders})", food_names)
+
+    def get_fitbit_token(self, user_id):
+        rows = self._query("select access_token from Fitbit_Token where user_id = ?", (user_id,))
+        return rows[0]["access_token"] if rows else None
+
+    def save_fitbit_token(self, user_id, access_token):
+        self._execute(
+            """insert into Fitbit_Token (user_id, access_token, updated_at) values (?, ?, datetime('now'))
+            on conflict (user_id) do update set access_token = excluded.access_token, updated_at = excluded.updated_at""",
+            (user_id, access_token)
+        )
+
+    def load_calories(self, rows):
+        # Seed CALORIES, e.g. from a CSV export of the Supabase table
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "insert or replace into CALORIES (food_name, servings, grams) values (?, ?, ?)",
+                [(row["food_name"], row.get("servings"), row.get("grams")) for row in rows]
+            )
+
+
+class CachedStorage(Storage):
+    # Per-user read-through cache in front of another Storage. A write for a user drops
+    # everything cached for that user; the TTL bounds staleness from other processes' writes.
+    def __init__(self, storage: Storage, ttl=READ_CACHE_TTL, max_users=READ_CACHE_USERS):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> {key: (stored_at, value)}, least recent first
+        # Writes seen during reads still in flight; only users with a read in flight have
+        # entries, so both stay as small as the number of concurrent reads
+        self._reads = {}  # user_id -> reads in flight
+        self._generations = {}  # user_id -> writes since the first of those reads started
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id, key, fetch):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._users.get(user_id, {}).get(key)
+            if hit and now - hit[0] < self.ttl:
+                self._users.move_to_end(user_id)
+                metrics.inc("read_cache_hits")
+                return copy.deepcopy(hit[1])
+            self._reads[user_id] = self._reads.get(user_id, 0) + 1
+            generation = self._generations.get(user_id, 0)
+
+        metrics.inc("read_cache_misses")
+        fetched = False
+        try:
+            value = fetch()
+            fetched = True
+        finally:
+            with self._lock:
+                # A write that finished while we were reading may not be in this value, don't keep it
+                fresh = self._generations.get(user_id, 0) == generation
+                self._reads[user_id] -= 1
+                if not self._reads[user_id]:
+                    del self._reads[user_id]
+                    self._generations.pop(user_id, None)
+                if fresh and fetched:
+                    self._users.setdefault(user_id, {})[key] = (now, copy.deepcopy(value))
+                    self._users.move_to_end(user_id)
+                    while len(self._users) > self.max_users:
+                        self._users.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if user_id in self._reads:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._users.pop(user_id, None)
+
+    def _write(self, user_ids, write):
+        # Invalidate even if the write fails, it may still have been applied
+        try:
+            return write()
+        finally:
+            for user_id in set(user_ids):
+                self.invalidate(user_id)
+
+    def get_all(self, table_name):
+        return self.storage.get_all(table_name)
+
+    def get_daily(self, user_id, date):
+        return self._cached(user_id, ("daily", date), lambda: self.storage.get_daily(user_id, date))
+
+    def get_user_daily(self, user_id):
+        return self._cached(user_id, ("user_daily",), lambda: self.storage.get_user_daily(user_id))
+
+    def insert_daily(self, row):
+        return self._write([row["user_id"]], lambda: self.storage.insert_daily(row))
+
+    def list_daily(self, user_id, since_date=None):
+        return self._cached(user_id, ("list_daily", since_date), lambda: self.storage.list_daily(user_id, since_date))
+
+    def insert_meal(self, row):
+        return self._write([row["user_id"]], lambda: self.storage.insert_meal(row))
+
+    def save_meal(self, row):
+        return self._write([row["user_id"]], lambda: self.storage.save_meal(row))
+
+    def save_meals(self, rows):
+        return self._write([row["user_id"] for row in rows], lambda: self.storage.save_meals(rows))
+
+    def list_meals(self, user_id, columns, since=None, before=None, limit=None):
+        return self._cached(
+            user_id, ("list_meals", tuple(columns), since, before, limit),
+            lambda: self.storage.list_meals(user_id, columns, since=since, before=before, limit=limit)
+        )
+
+    def list_food_totals(self, user_id, since_date=None):
+        return self._cached(user_id, ("food_totals", since_date), lambda: self.storage.list_food_totals(user_id, since_date))
+
+    def get_calories(self, food_names=None):
+        return self.storage.get_calories(food_names)
+
+    def get_fitbit_token(self, user_id):
+        return self._cached(user_id, ("fitbit_token",), lambda: self.storage.get_fitbit_token(user_id))
+
+    def save_fitbit_token(self, user_id, access_token):
+        return self._write([user_id], lambda: self.storage.save_fitbit_token(user_id, access_token))
+
+
+# One cached Storage per Supabase client, so every helper shares the same read cache
+_client_storages = weakref.WeakKeyDictionary()
+_client_storages_lock = threading.Lock()
+
+
+def as_storage(supabase) -> Storage:
+    # Helpers accept either a Storage or a raw Supabase client
+    if isinstance(supabase, Storage):
+        return supabase
+    with _client_storages_lock:
+        storage = _client_storages.get(supabase)
+        if storage is None:
+            storage = _client_storages[supabase] = CachedStorage(SupabaseStorage(supabase))
+    return storage
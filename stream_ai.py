@@ -1,21 +1,32 @@
 import streamlit as st
 import requests
-from PIL import Image
 import io
 import json
-from datetime import datetime, timedelta
-from dateutil import parser
+from datetime import datetime
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 import os
+import uuid
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import Client
+from db import get_supabase, new_auth_client
 import extra_streamlit_components as stx
 from fitbit import *
-from ai_model import food_detect
+from ai_model import food_detect, warmup
+from inference_client import INFERENCE_URL, InferenceClient
+from worker_pool import INFERENCE_WORKERS, InferenceBusy, InferencePool
+from preprocess import prepare_image
+from video_stream import stream_detect
 from api_info import *
+from storage import as_storage
+from write_queue import MealWriteQueue
+import metrics
+from nutrition import NutritionIndex, meal_nutrition
+from meal_history import DASHBOARD_WINDOW, load_meal_history, load_older_meals, slice_history, filter_history, foods_summary, meal_food_totals, per_meal_charts, rollup_since, rollup_daily_totals, rollup_food_totals
 
 #  page configuration
 st.set_page_config(
@@ -28,10 +39,72 @@ st.set_page_config(
 
 load_dotenv()
 
-# Initialize Supabase client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Opt-in metrics export: Prometheus text on METRICS_PORT (loopback unless METRICS_HOST
+# says otherwise), JSON snapshots to METRICS_FILE
+@st.cache_resource
+def start_metrics_export():
+    if os.getenv("METRICS_PORT"):
+        metrics.start_http_server(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+    if os.getenv("METRICS_FILE"):
+        metrics.start_json_writer(os.getenv("METRICS_FILE"), float(os.getenv("METRICS_INTERVAL", "15")))
+    return True
+
+start_metrics_export()
+
+
+# Load and warm up the detector once per server process, shared by every session.
+# With INFERENCE_URL set, detection goes to the standalone batching service instead,
+# with INFERENCE_WORKERS set, to a pool of worker processes off the script thread.
+@st.cache_resource(show_spinner="🔮 Loading food detection model...")
+def load_detector():
+    if INFERENCE_URL:
+        return InferenceClient(INFERENCE_URL).food_detect
+    if INFERENCE_WORKERS > 0:
+        return InferencePool().food_detect
+    warmup()
+    return food_detect
+
+detect_food = load_detector()
+
+
+def prepared_upload(uploaded_file):
+    # Decode each upload once per session: the preview and the detector reuse it on every rerun
+    cached = st.session_state.get('prepared_upload')
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, prepare_image(uploaded_file.getvalue()))
+        st.session_state['prepared_upload'] = cached
+    return cached[1]
+
+
+# Bounded pool for the dashboard's independent reads, shared by all sessions
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "8"))
+
+@st.cache_resource
+def dashboard_pool():
+    return ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+
+
+# One CALORIES index per server process, refreshed on its own TTL
+@st.cache_resource
+def nutrition_index(_supabase: Client):
+    return NutritionIndex(_supabase)
+
+
+# Meal saves are journaled and written in the background, one queue per server process
+@st.cache_resource
+def meal_write_queue(_supabase: Client):
+    return MealWriteQueue(_supabase)
+
+# Shared, pooled Supabase client for all data access
+supabase: Client = get_supabase()
+
+
+def auth_client() -> Client:
+    # Login state must not leak between users, so auth runs on a per-session client
+    if 'auth_client' not in st.session_state:
+        st.session_state['auth_client'] = new_auth_client()
+    return st.session_state['auth_client']
 
 
 
@@ -287,30 +360,11 @@ def fitbit_page():
     # Save button
     if st.button("Save Access Token"):
         if access_token.strip():
-            response = supabase.table("Fitbit_Token").select("*").eq("user_id", user_id).execute()
-
-            if response.data:
-                # User has a token, update it
-                update_response = supabase.table("Fitbit_Token").update({
-                    "access_token": access_token,
-                    "updated_at": "now()"
-                }).eq("user_id", user_id).execute()
-                
-                if not update_response:
-                    print(f"Error updating token: {update_response.error}")
-                else:
-                    print("Access token updated successfully.")
-            else:
-                # User does not have a token, insert new record
-                insert_response = supabase.table("Fitbit_Token").insert({
-                    "user_id": user_id,
-                    "access_token": access_token
-                }).execute()
-                
-                if not insert_response:
-                    print(f"Error inserting token: {insert_response.error}")
-                else:
-                    print("Access token inserted successfully.")
+            try:
+                as_storage(supabase).save_fitbit_token(user_id, access_token)
+            except Exception as e:
+                st.error(f"Error saving access token: {str(e)}")
+                st.stop()
             st.success("Your Fitbit access token has been saved!")
             st.session_state.page = 'home' 
             st.rerun()
@@ -413,6 +467,27 @@ def home_page():
             st.session_state.clear()
             st.rerun()
 
+    # Start every dashboard read at once, each section waits only for its own data
+    user_id = st.session_state['user_id']
+    # Saves are acknowledged before they are written, so report any the database refused
+    for rejected in meal_write_queue(supabase).take_rejected(user_id):
+        st.error(f"⚠️ A {rejected['meal_cal']} kcal meal saved at {rejected['timestamp'][:16]} could not be stored: {rejected['error']}")
+    pool = dashboard_pool()
+    # Today's Daily row together with meals still in the write queue, each counted once
+    latest_future = pool.submit(
+        meal_write_queue(supabase).daily_total, user_id, todays_date(),
+        lambda: get_latest_daily_data(supabase, user_id)
+    )
+    fitbit_future = pool.submit(get_fitbit_summary, supabase, user_id)
+    # Older "All Time" pages the user already paged in, kept per session
+    older_history = st.session_state.get('older_history') if time_filter == "All Time" else None
+    boundary = older_history["boundary"] if older_history else None
+    history_future = pool.submit(load_meal_history, supabase, user_id, time_filter, boundary)
+    per_meal_trend = per_meal_charts(time_filter)
+    if not per_meal_trend:
+        daily_future = pool.submit(get_daily_totals, supabase, user_id, rollup_since(time_filter))
+        food_future = pool.submit(get_food_totals, supabase, user_id, rollup_since(time_filter))
+
     # Main content
     col1, col2 = st.columns([1, 1])
 
@@ -424,65 +499,29 @@ def home_page():
 
         if uploaded_file is not None:
             initital.empty()
-            image = Image.open(uploaded_file)
+            # Draft-mode decode at display size, large phone photos never decode at full resolution
+            prepared = prepared_upload(uploaded_file)
+            image = prepared.display
             img=st.image(image, caption="Uploaded Image", use_container_width=True)
             
             if st.button("🔍 Analyze Food", key="analyze"):
                 with st.spinner("🔮 AI Analysis in Progress..."):
                     try:
-                        # Save the uploaded file temporarily
-                        temp_image_path = "temp_image.jpg"
-                        image.save(temp_image_path)
-
-                        json_out,output_image = food_detect(temp_image_path)
+                        # The inference service takes the encoded upload, in-process and pool
+                        # detection take the decoded image as is
+                        json_out,output_image = detect_food(uploaded_file.getvalue() if INFERENCE_URL else prepared)
 
                         json_data = json.loads(json_out)
 
-                        result = []
-                        meal_calories = 0
-                        seen = []
-
-                        # Loop through the parsed JSON data
-                        for i in range(len(json_data)):
-                            food_name = json_data[i]['food_name']  # Get the food name
-                            confidence = json_data[i]['confidence']  # Get the confidence score
-                            if confidence<0.8:
-                                continue
-                            food_count=json_data[i]['food_count']
-                            if food_name not in seen:
-                                seen.append(food_name)
-
-                                
-                                
-                                calories = (supabase.table("CALORIES").select("servings").eq("food_name",food_name).execute())
-                                # Extract the grams value from the response (ensure proper error handling)
-                                if calories and calories.data:
-                                    calories_per_serving = calories.data[0].get("servings", 0)
-                                    calories_servings = calories_per_serving * food_count
-                                else:
-                                    calories_servings = 0  # Default to 0 if no data is found
-                            
-                                calories = (supabase.table("CALORIES").select("grams").eq("food_name",food_name).execute())
-                                # Extract the grams value from the response (ensure proper error handling)
-                                if calories and calories.data:
-                                    calories_per_gram = calories.data[0].get("grams", 0)
-                                    calories_grams = calories_per_gram
-                                else:
-                                    calories_grams = 0  # Default to 0 if no data is found
+                        # Calories for every detected food come from the in-memory CALORIES index
+                        result = meal_nutrition(json_data, nutrition_index(supabase))
 
+                        meal_calories = 0
+                        for item in result:
                             if st.session_state.quantity_unit == "Servings":
-                                meal_calories += calories_servings
+                                meal_calories += item["calories_servings"]
                             elif st.session_state.quantity_unit == "Grams":
-                                meal_calories += calories_grams
-                            
-                            # Add the food item to the result list 
-                            result.append({
-                                "food": food_name,
-                                "calories_servings": calories_servings,
-                                "calories_grams": calories_grams, 
-                                "portion": food_count, 
-                                "confidence": confidence  # Confidence percentage
-                            })
+                                meal_calories += item["calories_grams"]
 
 
                         # Append to session history 
@@ -490,29 +529,75 @@ def home_page():
                             "timestamp": datetime.now(),
                             "foods": result,
                             'total_calories': st.session_state.history[-1]['total_calories']+meal_calories if st.session_state.history else meal_calories,
-                            'meal_calories': meal_calories
+                            'meal_calories': meal_calories,
+                            'request_id': str(uuid.uuid4())  # Makes a retried save of this meal idempotent
                         })
                         img.empty()
                         img.image(output_image, caption="Output Image", use_container_width=True)
                         st.success("✨ Analysis Complete!")
                         # st.image(output_image, caption="Output Image", use_container_width=True)
-                        os.remove(temp_image_path)
                         if result:
                             st.session_state.show_save_button = True  # Show save button after successful analysis
                         else:
                             st.warning("No food items detected in the image.")
+                    except InferenceBusy as e:
+                        st.warning(f"⏳ {str(e)}")
+                        st.session_state.show_save_button = False
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
                         st.session_state.show_save_button = False
+
+        with st.expander("🎥 Analyze a video pan instead"):
+            uploaded_video = st.file_uploader("Upload a short video", type=["mp4", "mov", "avi"], key="video")
+            if uploaded_video is not None and st.button("🔍 Analyze Video", key="analyze_video"):
+                frame_view = st.empty()
+                totals_view = st.empty()
+                # OpenCV reads from a path, not from memory. The file is closed before OpenCV
+                # opens it, Windows does not allow a second open of a NamedTemporaryFile.
+                with tempfile.NamedTemporaryFile(suffix=os.path.splitext(uploaded_video.name)[1], delete=False) as video_file:
+                    video_file.write(uploaded_video.getvalue())
+                try:
+                    json_out = "[]"
+                    # Running totals update as the video plays, each tracked item counted once
+                    for json_out, output_image in stream_detect(video_file.name):
+                        frame_view.image(output_image, caption="Live Detection", use_container_width=True)
+                        totals_view.json(json.loads(json_out))
+
+                    result = meal_nutrition(json.loads(json_out), nutrition_index(supabase))
+                    meal_calories = 0
+                    for item in result:
+                        if st.session_state.quantity_unit == "Servings":
+                            meal_calories += item["calories_servings"]
+                        elif st.session_state.quantity_unit == "Grams":
+                            meal_calories += item["calories_grams"]
+
+                    st.session_state.history.append({
+                        "timestamp": datetime.now(),
+                        "foods": result,
+                        'total_calories': st.session_state.history[-1]['total_calories']+meal_calories if st.session_state.history else meal_calories,
+                        'meal_calories': meal_calories,
+                        'request_id': str(uuid.uuid4())
+                    })
+                    if result:
+                        st.success("✨ Analysis Complete!")
+                        st.session_state.show_save_button = True
+                    else:
+                        st.warning("No food items detected in the video.")
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
+                    st.session_state.show_save_button = False
+                finally:
+                    os.remove(video_file.name)
         st.markdown("</div>", unsafe_allow_html=True)
 
     with col2:
         # st.markdown("<div class='result-box'>", unsafe_allow_html=True)
         st.markdown("<h2>📊 Latest Analytics</h2>", unsafe_allow_html=True)
 
-        latest = get_latest_daily_data(supabase,st.session_state['user_id'])
+        latest, queued_calories = latest_future.result()
+        latest = {**latest, "cal_consumed": latest["cal_consumed"] + queued_calories}
 
-        access_token = get_fitbit_token(supabase,st.session_state['user_id'])
+        summary = fitbit_future.result()
 
 
         colx1, colx2 = st.columns([1, 1])
@@ -530,23 +615,23 @@ def home_page():
         coly1, coly2,coly3 = st.columns([0.33,0.33,0.33])
 
         with coly1:
-            if access_token:
-                calories_burned = cal_burned(access_token)
+            if summary:
+                calories_burned = summary.get('caloriesOut')
                 if calories_burned:
                     create_metric_card("Calories Burned", calories_burned, suffix=" kcal")
 
         with coly2:
-            if access_token:
-                dist = dist_covered(access_token)
+            if summary and summary.get('distances'):
+                dist = summary['distances'][0]['distance']
                 if dist:
-                    dist = round(dist_covered(access_token), 2)
+                    dist = round(dist, 2)
                     if dist < 1:
                         create_metric_card("Distance Covered", round(dist*1000,2), suffix=" m")
                     else:
                         create_metric_card("Distance Covered", round(dist,2), suffix=" km")
         with coly3:
-            if access_token:
-                steps = steps_covered(access_token)
+            if summary:
+                steps = summary.get('steps')
                 if steps:
                     create_metric_card("Steps Travelled", steps , suffix=" steps")  
 
@@ -597,6 +682,7 @@ def home_page():
                     elif unit == "Grams":
                         # Display calculated calories
                         food_grams=st.number_input("Enter the grams of the food:",value=100,key=food['food'])
+                        food['grams']=food_grams
                         food_per_gram=food['calories_grams']
                         if 'calories_grams_updated' not in food:
                             food['calories_grams_updated']=int(food_grams*food_per_gram)
@@ -635,25 +721,26 @@ def home_page():
                     today_date = todays_date()
 
                     foods_detect=st.session_state.history[-1]["foods"]
-                    if st.session_state.quantity_unit == "Servings":
-                        foods_detected = [f"{item['food']}:{item['calories_servings']}kcal" for item in foods_detect]
-                    elif st.session_state.quantity_unit == "Grams":
-                        foods_detected = [f"{item['food']}:{item['calories_grams_updated']}kcal" for item in foods_detect]
-
-                    # Insert the meal into the database
-                    new_meal_insert(
-                        supabase=supabase,
+                    # Store each detection as a structured record
+                    foods_detected = [
+                        {
+                            "food_name": item['food'],
+                            "count": item['portion'],
+                            "calories": item['calories_grams_updated'] if st.session_state.quantity_unit == "Grams" else item['calories_servings'],
+                            "grams": item.get('grams') if st.session_state.quantity_unit == "Grams" else None,
+                            "confidence": item['confidence']
+                        }
+                        for item in foods_detect
+                    ]
+
+                    # Journal the meal and return right away; the write queue saves it in the background
+                    meal_write_queue(supabase).submit(
                         user_id=user_id,
                         today_date=today_date,
                         meal_cal=latest['meal_calories'],
-                        foods_detected=foods_detected
+                        foods_detected=foods_detected,
+                        request_id=latest.get('request_id')
                     )
-
-                    # Fetch the updated total calories for the day
-                    updated_calories = get_cal_consumed(supabase,user_id, today_date)
-
-                    # Update the Total Calories metric dynamically
-                    latest['total_calories'] = updated_calories
                     st.session_state.history[-1] = latest
                     st.success("Meal saved successfully!")
                     st.session_state.show_save_button = False  # Hide button after saving
@@ -671,24 +758,25 @@ def home_page():
     st.markdown("<h2>📈 Analytics Dashboard</h2>", unsafe_allow_html=True)
 
 
-    def fetch_meal_history_last_24_hours(user_id):
-        last_24_hours = datetime.now() - timedelta(days=1)
-        result = (
-            supabase.table("Meals")
-            .select("timestamp, meal_cal")
-            .eq("user_id", user_id)
-            .gte("timestamp", last_24_hours.isoformat())  # Filter for the last 24 hours
-            .order("timestamp", desc=True)  # Order by latest first
-            .execute()
-        )
-        return result.data
-    
+    # Charts and table all slice the one history frame
+    meal_history, history_cursor = history_future.result()
+    if older_history:
+        # Meals sharing the boundary's timestamp can be in both frames
+        meal_history = pd.concat([meal_history, older_history["frame"]], ignore_index=True).drop_duplicates("id")
+        history_cursor = older_history["cursor"]
+    recent_history = slice_history(meal_history, DASHBOARD_WINDOW)
 
-
-    meal_history = fetch_meal_history_last_24_hours(st.session_state['user_id'])
+    if per_meal_trend:
+        food_chart = meal_food_totals(recent_history)
+        has_trend = not recent_history.empty
+    else:
+        # Longer windows are charted from the small per-day and per-food rollups
+        daily_totals = rollup_daily_totals(daily_future.result())
+        food_chart = rollup_food_totals(food_future.result())
+        has_trend = not daily_totals.empty
     
 
-    if meal_history:
+    if has_trend:
         # Create sample data for last 7 days
         vis_cols = st.columns([2, 1])
         
@@ -696,40 +784,47 @@ def home_page():
             # st.markdown("<div class='result-box'>", unsafe_allow_html=True)
             
             # Calorie Trend Chart
-            df_history = pd.DataFrame([
-                {
-                "Time": pd.to_datetime(entry["timestamp"]),
-                "Calories": entry["meal_cal"]
-                }
-                for entry in meal_history
-            ])
-            
-            df_today = df_history[df_history["Time"].dt.date == pd.to_datetime(todays_date()).date()]
-            df_today["Cumulative Calories"]=df_today["Calories"][::-1].cumsum()
-
             fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=df_history["Time"],
-                y=df_history["Calories"],
-                mode='lines+markers',
-                name='Calories',
-                line=dict(color='#00ff88', width=2),
-                marker=dict(size=8, symbol='diamond')
-            ))
-
-            # Add cumulative calorie line
-            fig.add_trace(go.Scatter(
-            x=df_today["Time"],
-            y=df_today["Cumulative Calories"],
-            mode='markers+lines',
-            name='Cumulative Calories',
-            line=dict(color='#ff8800', width=2),
-            marker=dict(size=6)
-            ))
+            if per_meal_trend:
+                df_history = recent_history.rename(columns={"timestamp": "Time", "meal_cal": "Calories"})
+                
+                df_today = df_history[df_history["Time"].dt.date == pd.to_datetime(todays_date()).date()].copy()
+                df_today["Cumulative Calories"]=df_today["Calories"][::-1].cumsum()
+
+                fig.add_trace(go.Scatter(
+                    x=df_history["Time"],
+                    y=df_history["Calories"],
+                    mode='lines+markers',
+                    name='Calories',
+                    line=dict(color='#00ff88', width=2),
+                    marker=dict(size=8, symbol='diamond')
+                ))
+
+                # Add cumulative calorie line
+                fig.add_trace(go.Scatter(
+                x=df_today["Time"],
+                y=df_today["Cumulative Calories"],
+                mode='markers+lines',
+                name='Cumulative Calories',
+                line=dict(color='#ff8800', width=2),
+                marker=dict(size=6)
+                ))
+                trend_x = df_history["Time"]
+            else:
+                # One point per day straight from the Daily rollup
+                fig.add_trace(go.Scatter(
+                    x=daily_totals["date"],
+                    y=daily_totals["cal_consumed"],
+                    mode='lines+markers',
+                    name='Daily Calories',
+                    line=dict(color='#00ff88', width=2),
+                    marker=dict(size=8, symbol='diamond')
+                ))
+                trend_x = daily_totals["date"]
             # Add daily goal line
             fig.add_trace(go.Scatter(
-                x=df_history["Time"],
-                y=[st.session_state.daily_goal] * len(df_history),
+                x=trend_x,
+                y=[st.session_state.daily_goal] * len(trend_x),
                 mode='lines',
                 name='Daily Goal',
                 line=dict(color='#00ccff', width=2, dash='dash')
@@ -752,36 +847,11 @@ def home_page():
         
         with vis_cols[1]:
             # Calorie Distribution Pie Chart
-            def fetch_meal_history_last_24_hours(user_id):
-                last_24_hours = datetime.now() - timedelta(days=1)
-                result = (
-                    supabase.table("Meals")
-                    .select("timestamp,foods_detected,meal_cal")
-                    .eq("user_id", user_id)
-                    .gte("timestamp", last_24_hours.isoformat())  # Filter for the last 24 hours
-                    .order("timestamp", desc=True)  # Order by latest first
-                    .execute()
-                )
-                return result.data
-    
-
-
-            meal_history = fetch_meal_history_last_24_hours(st.session_state['user_id'])
-            food_chart=[foods["foods_detected"] for foods in meal_history]
 
 
-            if food_chart:
-                labels = []
-                values = []
-                for sublist in food_chart:
-                    for item in sublist:
-                        # Split each item by the colon to separate the food name and calorie count
-                        food_name, calorie_str = item.split(':')
-                        # Remove the 'kcal' part and convert the calorie value to an integer
-                        calories = int(calorie_str.replace('kcal', ''))
-                        # Append the food name and calorie value to the respective lists
-                        labels.append(food_name)
-                        values.append(calories)
+            if not food_chart.empty:
+                labels = food_chart.index
+                values = food_chart["calories"]
 
 
                 # latest = st.session_state.history
@@ -809,52 +879,38 @@ def home_page():
                 st.plotly_chart(fig, use_container_width=True)
             st.markdown("</div>", unsafe_allow_html=True)
     else:
-        st.info("No meal history available for the last 24 hours.")
-
-    # Function to filter history based on the selected time filter
-    def get_meal_history(supabase, user_id, time_filter):
-        current_time = datetime.now()
-        
-        if time_filter == "Last 24 Hours":
-            time_threshold = current_time - timedelta(days=1)
-        elif time_filter == "Last Week":
-            time_threshold = current_time - timedelta(weeks=1)
-        elif time_filter == "Last Month":
-            time_threshold = current_time - timedelta(days=30)
-        else:  # "All Time"
-            time_threshold = datetime.min
-        
-        results = supabase.table('Meals') \
-            .select('timestamp, meal_cal, foods_detected') \
-            .eq('user_id', user_id) \
-            .gte('timestamp', time_threshold.isoformat()) \
-            .order('timestamp', desc=True) \
-            .execute()
-        
-        return results.data
+        st.info(f"No meal history available for: {time_filter}")
 
     # History Table
     st.markdown("---")
     st.markdown("<h2>📜 Analysis History</h2>", unsafe_allow_html=True)
     st.markdown(f"Showing data from: {time_filter}")
     # Filter history based on the selected time filter
-    filtered_history = get_meal_history(supabase, st.session_state["user_id"], time_filter)
+    filtered_history = filter_history(meal_history, time_filter)
 
 
 
-    if filtered_history:
-        history_df = pd.DataFrame([
-            {
-                "Time": parser.isoparse(entry["timestamp"]).strftime("%Y-%m-%d %H:%M:%S"),
-                "Meal Calories": entry["meal_cal"],
-                "Foods Detected": ", ".join(i for i in entry["foods_detected"] or [])
-            }
-            for entry in filtered_history[::-1]  # Reverse to display most recent first
-        ])
+    if not filtered_history.empty:
+        filtered_history = filtered_history[::-1]  # Reverse to display most recent first
+        history_df = pd.DataFrame({
+            "Time": filtered_history["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+            "Meal Calories": filtered_history["meal_cal"],
+            "Foods Detected": foods_summary(filtered_history)
+        })
         history_df.index=range(1,len(history_df)+1)
         st.dataframe(history_df, use_container_width=True)
     else:
         st.info("No analysis history available for the selected filter. Upload an image to get started!")
+
+    # Older pages are only fetched when asked for, one keyset page at a time
+    if history_cursor and st.button("⏬ Load older meals", key="load_older"):
+        older_frame, next_cursor = load_older_meals(supabase, user_id, history_cursor)
+        st.session_state['older_history'] = {
+            "boundary": boundary or history_cursor,
+            "frame": pd.concat([older_history["frame"], older_frame], ignore_index=True) if older_history else older_frame,
+            "cursor": next_cursor
+        }
+        st.rerun()
     
     # Footer
     st.markdown("---")
@@ -877,7 +933,7 @@ def main():
 
 
     load_dotenv()
-    supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    supabase: Client = auth_client()
 
     # Initialize session state
     if 'logged_in' not in st.session_state:
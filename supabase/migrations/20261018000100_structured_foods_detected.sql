@@ -0,0 +1,85 @@
+-- Meals.foods_detected holds structured records instead of "name:NNNkcal" strings:
+--   [{"food_name": "rice", "count": 2, "calories": 260, "grams": null, "confidence": 0.91}, ...]
+--
+-- The app always sent a list of those strings, but depending on how the column was created
+-- it holds them as text[], as a json/jsonb array, or as text (a JSON array or an array
+-- literal). The conversion below branches on the actual column type and stops with an
+-- error, before touching any row, on anything else.
+
+create or replace function legacy_foods_detected(items text[])
+returns jsonb
+language sql
+immutable
+as $$
+    select coalesce(
+        jsonb_agg(jsonb_build_object(
+            'food_name', split_part(item, ':', 1),
+            'count', 1,
+            'calories', nullif(replace(split_part(item, ':', 2), 'kcal', ''), '')::numeric,
+            'grams', null,
+            'confidence', null
+        )),
+        '[]'::jsonb
+    )
+    from unnest(items) as item
+$$;
+
+create or replace function legacy_foods_detected_json(items jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select case
+        when items is null or jsonb_typeof(items) <> 'array' then '[]'::jsonb
+        -- Rows already in the structured format are kept as they are
+        when exists (select 1 from jsonb_array_elements(items) as item where jsonb_typeof(item) = 'object') then items
+        else legacy_foods_detected(array(select jsonb_array_elements_text(items)))
+    end
+$$;
+
+create or replace function legacy_foods_detected_text(value text)
+returns jsonb
+language sql
+immutable
+as $$
+    select case
+        when value is null or btrim(value) = '' then '[]'::jsonb
+        when left(btrim(value), 1) = '[' then legacy_foods_detected_json(value::jsonb)
+        when left(btrim(value), 1) = '{' then legacy_foods_detected(value::text[])
+        else legacy_foods_detected(array[value])
+    end
+$$;
+
+do $$
+declare
+    column_type text;
+    conversion text;
+begin
+    select format_type(a.atttypid, a.atttypmod) into column_type
+    from pg_attribute as a
+    where a.attrelid = '"Meals"'::regclass and a.attname = 'foods_detected' and not a.attisdropped;
+
+    if column_type is null then
+        raise exception 'Meals.foods_detected does not exist';
+    elsif column_type like '%[]' then
+        conversion := 'legacy_foods_detected(foods_detected::text[])';
+    elsif column_type in ('json', 'jsonb') then
+        conversion := 'legacy_foods_detected_json(foods_detected::jsonb)';
+    elsif column_type = 'text' or column_type like 'character varying%' then
+        conversion := 'legacy_foods_detected_text(foods_detected::text)';
+    else
+        raise exception 'Meals.foods_detected has unsupported type %, expected text[], json, jsonb or text', column_type;
+    end if;
+
+    -- An old default (e.g. '{}'::text[]) cannot be converted along with the column
+    alter table "Meals" alter column foods_detected drop default;
+    execute format('alter table "Meals" alter column foods_detected type jsonb using %s', conversion);
+end;
+$$;
+
+alter table "Meals"
+    alter column foods_detected set default '[]'::jsonb;
+
+drop function legacy_foods_detected_text(text);
+drop function legacy_foods_detected_json(jsonb);
+drop function legacy_foods_detected(text[]);
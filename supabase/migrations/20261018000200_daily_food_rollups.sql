@@ -0,0 +1,51 @@
+-- Per-user, per-day, per-food totals for the analytics dashboard.
+-- Daily.cal_consumed already carries the per-day calorie total; this adds the per-food
+-- breakdown so charts read O(days) rollup rows instead of scanning Meals.
+
+create table if not exists "Daily_Foods" (
+    user_id uuid not null,
+    date date not null,
+    food_name text not null,
+    count integer not null default 0,
+    calories numeric not null default 0,
+    primary key (user_id, date, food_name)
+);
+
+create or replace function rollup_meal_foods()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into "Daily_Foods" (user_id, date, food_name, count, calories)
+    select
+        new.user_id,
+        new.date,
+        food->>'food_name',
+        sum(coalesce((food->>'count')::integer, 1)),
+        sum(coalesce((food->>'calories')::numeric, 0))
+    from jsonb_array_elements(coalesce(new.foods_detected, '[]'::jsonb)) as food
+    group by food->>'food_name'
+    on conflict (user_id, date, food_name) do update
+        set count = "Daily_Foods".count + excluded.count,
+            calories = "Daily_Foods".calories + excluded.calories;
+    return new;
+end;
+$$;
+
+drop trigger if exists meals_rollup_foods on "Meals";
+create trigger meals_rollup_foods
+    after insert on "Meals"
+    for each row execute function rollup_meal_foods();
+
+-- Backfill from existing meals
+insert into "Daily_Foods" (user_id, date, food_name, count, calories)
+select
+    m.user_id,
+    m.date,
+    food->>'food_name',
+    sum(coalesce((food->>'count')::integer, 1)),
+    sum(coalesce((food->>'calories')::numeric, 0))
+from "Meals" as m
+cross join lateral jsonb_array_elements(coalesce(m.foods_detected, '[]'::jsonb)) as food
+group by m.user_id, m.date, food->>'food_name'
+on conflict (user_id, date, food_name) do nothing;
@@ -0,0 +1,34 @@
+-- One round trip per meal save: create the Daily row if needed, insert the meal and
+-- return the updated daily totals. request_id makes retries of the same save a no-op.
+
+alter table "Meals" add column if not exists request_id uuid;
+create unique index if not exists meals_request_id_key on "Meals" (request_id);
+
+-- ON CONFLICT below needs Daily to be unique per user and day
+create unique index if not exists daily_user_date_key on "Daily" (user_id, date);
+
+create or replace function save_meal(
+    p_user_id uuid,
+    p_date date,
+    p_timestamp timestamptz,
+    p_meal_cal numeric,
+    p_foods_detected jsonb,
+    p_request_id uuid
+)
+returns setof "Daily"
+language plpgsql
+as $$
+begin
+    insert into "Daily" (user_id, date, cal_consumed, cal_burnt, steps, distance)
+    values (p_user_id, p_date, 0, 0, 0, 0)
+    on conflict (user_id, date) do nothing;
+
+    -- Meals triggers keep Daily.cal_consumed and Daily_Foods current within this transaction
+    insert into "Meals" (user_id, date, timestamp, meal_cal, foods_detected, request_id)
+    values (p_user_id, p_date, p_timestamp, p_meal_cal, coalesce(p_foods_detected, '[]'::jsonb), p_request_id)
+    on conflict (request_id) do nothing;
+
+    return query
+        select * from "Daily" where user_id = p_user_id and date = p_date;
+end;
+$$;
@@ -0,0 +1,24 @@
+-- Several queued meal saves in one round trip and one transaction. Each element has the
+-- save_meal fields; request_id keeps a replayed batch from inserting any meal twice.
+
+create or replace function save_meals(p_meals jsonb)
+returns setof "Daily"
+language plpgsql
+as $$
+declare
+    meal jsonb;
+begin
+    for meal in select * from jsonb_array_elements(p_meals)
+    loop
+        return query
+            select * from save_meal(
+                (meal->>'user_id')::uuid,
+                (meal->>'date')::date,
+                (meal->>'timestamp')::timestamptz,
+                (meal->>'meal_cal')::numeric,
+                meal->'foods_detected',
+                (meal->>'request_id')::uuid
+            );
+    end loop;
+end;
+$$;
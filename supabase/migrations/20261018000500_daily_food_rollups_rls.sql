@@ -0,0 +1,70 @@
+-- Daily_Foods holds per-user data, so it gets row level security: users can read only
+-- their own rows, and nobody writes them directly. Only the rollup functions below do,
+-- as security definer, so Daily_Foods cannot drift from Meals and saving a meal works
+-- whichever key or session the client that inserts into Meals is using.
+
+alter table "Daily_Foods" enable row level security;
+
+drop policy if exists "Users can read their own food rollups" on "Daily_Foods";
+create policy "Users can read their own food rollups"
+    on "Daily_Foods" for select
+    using (auth.uid() = user_id);
+
+drop policy if exists "Users can insert their own food rollups" on "Daily_Foods";
+drop policy if exists "Users can update their own food rollups" on "Daily_Foods";
+drop policy if exists "Users can delete their own food rollups" on "Daily_Foods";
+
+-- Meals are not append-only: an edited or deleted meal takes its foods back out of the
+-- rollup before the new version (if any) is added, so Daily_Foods always matches Meals.
+create or replace function apply_meal_foods(p_user_id uuid, p_date date, p_foods jsonb, p_sign integer)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into "Daily_Foods" (user_id, date, food_name, count, calories)
+    select
+        p_user_id,
+        p_date,
+        food->>'food_name',
+        p_sign * sum(coalesce((food->>'count')::integer, 1)),
+        p_sign * sum(coalesce((food->>'calories')::numeric, 0))
+    from jsonb_array_elements(coalesce(p_foods, '[]'::jsonb)) as food
+    group by food->>'food_name'
+    on conflict (user_id, date, food_name) do update
+        set count = "Daily_Foods".count + excluded.count,
+            calories = "Daily_Foods".calories + excluded.calories;
+
+    -- A food whose last meal of the day went away has nothing left to chart
+    if p_sign < 0 then
+        delete from "Daily_Foods"
+        where user_id = p_user_id and date = p_date and count <= 0;
+    end if;
+end;
+$$;
+
+-- Only the trigger should be able to adjust rollups
+revoke execute on function apply_meal_foods(uuid, date, jsonb, integer) from public, anon, authenticated;
+
+create or replace function rollup_meal_foods()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform apply_meal_foods(old.user_id, old.date, old.foods_detected, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform apply_meal_foods(new.user_id, new.date, new.foods_detected, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists meals_rollup_foods on "Meals";
+create trigger meals_rollup_foods
+    after insert or update of user_id, date, foods_detected or delete on "Meals"
+    for each row execute function rollup_meal_foods();
@@ -0,0 +1,8 @@
+-- Meal history pages on a (timestamp, id) keyset cursor: meals saved in the same instant
+-- (a batched write, a bulk backfill) share a timestamp, and id breaks the tie so a page
+-- boundary never skips or repeats one of them.
+
+alter table "Meals" add column if not exists id bigint generated by default as identity;
+create unique index if not exists meals_id_key on "Meals" (id);
+
+create index if not exists meals_user_timestamp_id on "Meals" (user_id, timestamp desc, id desc);
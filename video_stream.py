@@ -0,0 +1,102 @@
+import json
+import os
+import cv2
+import numpy as np
+from ai_model import DEFAULT_WEIGHTS, DETECT_CONFIDENCE, MIN_CONFIDENCE, annotated_image, tracking_model
+import metrics
+
+TRACKER = os.getenv("VIDEO_TRACKER", "bytetrack.yaml")
+MIN_STRIDE = 1
+MAX_STRIDE = int(os.getenv("VIDEO_MAX_STRIDE", "8"))
+# Mean absolute difference of 32x32 grayscale thumbnails, on a 0-255 scale
+MOTION_LOW = 2.0
+MOTION_HIGH = 8.0
+# A track has to show up on this many processed frames before it counts, which drops flicker
+MIN_TRACK_FRAMES = 2
+
+
+def _thumbnail(frame):
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def next_stride(stride, motion):
+    # Pan fast -> look at every frame, hold still -> skip more of them
+    if motion > MOTION_HIGH:
+        return max(MIN_STRIDE, stride // 2)
+    if motion < MOTION_LOW:
+        return min(MAX_STRIDE, stride * 2)
+    return stride
+
+
+class TrackCounter:
+    # Running per-food totals where every tracked object counts once, however many frames it is in
+    def __init__(self, names, min_track_frames=MIN_TRACK_FRAMES):
+        self.names = names
+        self.min_track_frames = min_track_frames
+        self.tracks = {}  # track id -> [class id, frames seen, max confidence]
+
+    def update(self, result):
+        boxes = result.boxes
+        if boxes is None or boxes.id is None:
+            return
+        boxes = boxes.cpu().numpy()
+        for track_id, class_id, confidence in zip(boxes.id.astype(int), boxes.cls.astype(int), boxes.conf):
+            track = self.tracks.get(track_id)
+            if track is None:
+                self.tracks[track_id] = [class_id, 1, float(confidence)]
+            else:
+                track[1] += 1
+                track[2] = max(track[2], float(confidence))
+
+    def foods(self) -> list:
+        # Same records as ai_model.detected_foods, with tracks in place of boxes
+        totals = {}
+        for class_id, frames, confidence in self.tracks.values():
+            if frames < self.min_track_frames:
+                continue
+            food_name = self.names[class_id]
+            if food_name in totals:
+                totals[food_name]["food_count"] += 1
+                totals[food_name]["confidence"] = max(totals[food_name]["confidence"], confidence)
+            else:
+                totals[food_name] = {"food_name": food_name, "food_count": 1, "confidence": confidence}
+        # A food counts once its best track makes the cut, then with all of its tracks
+        return [food for food in totals.values() if food["confidence"] >= MIN_CONFIDENCE]
+
+
+def stream_detect(source, weights_path=DEFAULT_WEIGHTS, max_stride=MAX_STRIDE):
+    # Yields (json_output, annotated_image) like food_detect after every processed frame, with
+    # the running totals so far. source is a video path or a webcam index.
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Error opening video source: {source}")
+
+    stride = MIN_STRIDE
+    previous = None
+    try:
+        with tracking_model(weights_path) as model:
+            counter = TrackCounter(model.names)
+            while True:
+                # grab() skips frames without converting them
+                for _ in range(stride - 1):
+                    if not capture.grab():
+                        return
+                    metrics.inc("video_frames_skipped")
+                ok, frame = capture.read()
+                if not ok:
+                    return
+
+                thumbnail = _thumbnail(frame)
+                if previous is not None:
+                    stride = min(max_stride, next_stride(stride, float(np.abs(thumbnail - previous).mean())))
+                previous = thumbnail
+
+                with metrics.span("video_frame"):
+                    results = model.track(frame, persist=True, tracker=TRACKER, conf=DETECT_CONFIDENCE, verbose=False)
+                metrics.inc("video_frames_processed")
+                counter.update(results[0])
+
+                output_image = annotated_image(results[0])
+                yield json.dumps(counter.foods(), indent=4), output_image
+    finally:
+        capture.release()
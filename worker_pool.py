@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "1"))
+
+
+class InferenceBusy(RuntimeError):
+    pass
+
+
+# Set in each worker process by _init_worker
+_weights_path = None
+_warmed = None  # Shared count of workers with a warm model
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _init_worker(weights_path, cores, next_slot, threads, warmed):
+    global _weights_path, _warmed
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+    # One core per worker so workers don't fight over the same caches and run queue
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cores[slot % len(cores)]})
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import torch
+    from ai_model import warmup
+    torch.set_num_threads(threads)
+    _weights_path = weights_path
+    warmup(weights_path)
+    _warmed = warmed
+    with warmed.get_lock():
+        warmed.value += 1
+
+
+def _wait_warm(workers):
+    # Holds its worker until every worker is warm, so one of these per worker makes the
+    # pool spawn all of its processes and returns only once each has loaded its model
+    while _warmed.value < workers:
+        time.sleep(0.05)
+
+
+def _detect(image):
+    from ai_model import food_detect
+    return food_detect(image, _weights_path)
+
+
+def _detect_batch(images, annotate):
+    from ai_model import food_detect_batch
+    return food_detect_batch(images, batch_size=len(images), weights_path=_weights_path, annotate=annotate)
+
+
+class InferencePool:
+    # Worker processes pinned to cores, each with its own loaded model, so a forward pass
+    # never holds the caller's GIL. At most workers + max_queue jobs are accepted at once;
+    # past that submit raises InferenceBusy instead of letting requests pile up.
+    # Workers are started and warmed at construction, which waits for them unless wait=False.
+    def __init__(self, weights_path=None, workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE, threads=INFERENCE_WORKER_THREADS, wait=True):
+        from ai_model import DEFAULT_WEIGHTS
+        self.weights_path = weights_path or DEFAULT_WEIGHTS
+        self.workers = workers
+        # Spawn, not fork: the parent may already be running torch and server threads
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.weights_path, _available_cores(), context.Value("i", 0), threads, context.Value("i", 0))
+        )
+        # The executor only spawns processes on submit, so start every worker now
+        self._warmup = [self._executor.submit(_wait_warm, workers) for _ in range(workers)]
+        if wait:
+            self.wait_ready()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._outstanding = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            metrics.inc("inference_busy")
+            raise InferenceBusy("The food detector is busy, please try again in a moment")
+        self._track(1)
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def food_detect(self, image, timeout=None):
+        if isinstance(image, memoryview):
+            image = bytes(image)
+        return self.submit(_detect, image).result(timeout)
+
+    def food_detect_batch(self, images, annotate=True):
+        return self.submit(_detect_batch, list(images), annotate)
+
+    def wait_ready(self, timeout=None):
+        for future in self._warmup:
+            future.result(timeout)
+
+    def ready(self) -> bool:
+        return all(future.done() and future.exception() is None for future in self._warmup)
+
+    def _release(self):
+        self._track(-1)
+        self._slots.release()
+
+    def _track(self, delta):
+        with self._lock:
+            self._outstanding += delta
+            metrics.set_gauge("inference_in_flight", self._outstanding)
+            metrics.set_gauge("inference_queue_depth", max(0, self._outstanding - self.workers))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from api_info import timestampz
+from storage import as_storage
+import metrics
+
+WRITE_JOURNAL = os.getenv("WRITE_JOURNAL", ".smartbite_write_journal.jsonl")
+BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW", "0.25"))
+MAX_BATCH = int(os.getenv("WRITE_MAX_BATCH", "50"))
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+logger = logging.getLogger(__name__)
+
+# Postgres error classes that will fail the same way on every retry: bad data (22),
+# constraint violations (23) and schema/permission errors (42); PGRST1xx are rejected requests
+PERMANENT_ERROR_CODES = ("22", "23", "42", "PGRST1")
+
+
+def is_permanent_error(error) -> bool:
+    # Everything else (network errors, timeouts, 5xx, outages) is retried indefinitely
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError, KeyError, TypeError)):
+        return True
+    return str(getattr(error, "code", "") or "").startswith(PERMANENT_ERROR_CODES)
+
+
+class MealWriteQueue:
+    # Write-behind queue for meal saves: acknowledged once journaled, written in batches by a
+    # background thread, retried with backoff for as long as errors are transient and replayed
+    # from the journal after a restart. Only rows the database refuses outright are set aside.
+    # Every row carries a request_id, so a replayed or retried save is never applied twice.
+    def __init__(self, supabase, journal_path=WRITE_JOURNAL, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.storage = as_storage(supabase)
+        self.journal_path = journal_path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._pending = OrderedDict()  # request_id -> row
+        self._rejected = {}  # user_id -> rows the database refused, until the user is told
+        self._in_flight = set()  # request_ids being written, possibly committed but still pending
+        self._writes_started = 0
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._replay_journal()
+        self._worker = threading.Thread(target=self._run, name="meal-write-queue", daemon=True)
+        self._worker.start()
+
+    def submit(self, user_id, today_date, meal_cal, foods_detected, request_id=None) -> str:
+        row = {
+            "user_id": user_id,
+            "date": today_date,
+            "timestamp": timestampz(),
+            "meal_cal": meal_cal,
+            "foods_detected": foods_detected,
+            "request_id": request_id or str(uuid.uuid4())
+        }
+        with self._cond:
+            if row["request_id"] in self._pending:
+                return row["request_id"]
+            self._append_journal([{"op": "save", "row": row}])
+            self._pending[row["request_id"]] = row
+            metrics.set_gauge("write_queue_depth", len(self._pending))
+            self._cond.notify()
+        return row["request_id"]
+
+    def daily_total(self, user_id, today_date, read_daily, attempts=3):
+        # Returns (read_daily(), calories still queued for that day) with every meal counted
+        # exactly once: the pair is only trusted if no write could commit during the read
+        for _ in range(attempts):
+            with self._cond:
+                started = self._writes_started
+                quiet = not self._in_flight
+            daily = read_daily()
+            with self._cond:
+                if quiet and self._writes_started == started:
+                    return daily, self._queued_calories(user_id, today_date)
+            time.sleep(self.batch_window)
+
+        # Writes kept overlapping: leave out rows whose commit is in doubt, they show up
+        # in Daily once written. This can briefly undercount but never counts a meal twice.
+        with self._cond:
+            return daily, self._queued_calories(user_id, today_date, skip=self._in_flight)
+
+    def _queued_calories(self, user_id, today_date, skip=()):
+        # Caller holds the condition
+        return sum(
+            row["meal_cal"] for request_id, row in self._pending.items()
+            if row["user_id"] == user_id and row["date"] == today_date and request_id not in skip
+        )
+
+    def take_rejected(self, user_id) -> list:
+        # Meals that were acknowledged but could never be written, each reported once
+        with self._cond:
+            return self._rejected.pop(user_id, [])
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let saves that arrive within the window share one round trip
+            time.sleep(self.batch_window)
+
+            # Any error, including journal I/O, must not end the thread: the rows stay
+            # pending and in the journal, and the iteration is retried after a backoff
+            try:
+                self._write_batch()
+                failures = 0
+            except Exception:
+                failures += 1
+                metrics.inc("write_queue_errors")
+                logger.exception("Meal write queue iteration failed, retrying (attempt %d)", failures)
+                time.sleep(min(MAX_BACKOFF, BASE_BACKOFF * 2 ** min(failures, 10)) * random.uniform(0.5, 1.0))
+
+    def _write_batch(self):
+        with self._cond:
+            batch = list(self._pending.values())[:self.max_batch]
+
+        try:
+            with metrics.span("write_queue_batch"):
+                self._save(batch)
+        except Exception as e:
+            if not is_permanent_error(e):
+                metrics.inc("write_queue_retries")
+                raise
+            # The batch was refused as a whole: save row by row so only the bad rows are set aside
+            self._isolate_rejected(batch)
+            return
+
+        metrics.inc("write_queue_saved", len(batch))
+        self._complete(batch)
+
+    def _save(self, rows):
+        # Rows stay in flight from before the write until _complete or a failed write
+        ids = {row["request_id"] for row in rows}
+        with self._cond:
+            self._writes_started += 1
+            self._in_flight |= ids
+        try:
+            self.storage.save_meals(rows)
+        except Exception:
+            # A failed write almost never committed, count the rows as queued again
+            with self._cond:
+                self._in_flight -= ids
+            raise
+
+    def _isolate_rejected(self, batch):
+        for row in batch:
+            try:
+                self._save([row])
+            except Exception as e:
+                if not is_permanent_error(e):
+                    metrics.inc("write_queue_retries")
+                    raise
+                self._reject(row, e)
+                continue
+            metrics.inc("write_queue_saved")
+            self._complete([row])
+
+    def _reject(self, row, error):
+        # Keep the row on disk for manual replay and let the user know on their next rerun
+        with open(f"{self.journal_path}.failed", "a") as f:
+            f.write(json.dumps({"row": row, "error": str(error)}) + "\n")
+        metrics.inc("write_queue_dead_letters")
+        logger.error("Meal %s rejected by the database: %s", row["request_id"], error)
+        with self._cond:
+            self._rejected.setdefault(row["user_id"], []).append({**row, "error": str(error)})
+        self._complete([row])
+
+    def _complete(self, rows):
+        # One fsync for the whole batch, outside the condition so submit and daily_total
+        # never wait on the disk. Only this thread completes rows, and truncation below
+        # still happens under the condition, after any save journaled by submit.
+        self._append_journal([{"op": "done", "request_id": row["request_id"]} for row in rows])
+        with self._cond:
+            for row in rows:
+                self._pending.pop(row["request_id"], None)
+                self._in_flight.discard(row["request_id"])
+            if not self._pending:
+                self._truncate_journal()
+            metrics.set_gauge("write_queue_depth", len(self._pending))
+            self._cond.notify_all()
+
+    def _append_journal(self, entries):
+        with self._journal_lock, open(self.journal_path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_journal(self):
+        with self._journal_lock:
+            open(self.journal_path, "w").close()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn final line from a crash mid-write
+                if entry.get("op") == "save":
+                    self._pending[entry["row"]["request_id"]] = entry["row"]
+                elif entry.get("op") == "done":
+                    self._pending.pop(entry["request_id"], None)
+        metrics.set_gauge("write_queue_depth", len(self._pending))